@@ -17,6 +17,7 @@ setup(
             "tneo=wordclock.tneo:main",
             "tsense=wordclock.tsense:main",
             "twords=wordclock.twords:main",
+            "wc-bench=wordclock.bench:main",
             "wc=wordclock.wc:main",
             "send-log=wordclock.send_log:main",
             "get-update=wordclock.get_update:main",
@@ -0,0 +1,242 @@
+'''
+The web site's files, served from memory.
+
+Each file is read once, compressed once with gzip (and brotli, if it is
+installed), and read again only when its modification time changes. Responses
+carry an ETag and a Last-Modified date, and conditional requests that match
+them get a 304 with no body.
+
+The settings page refers to the static files with their ETags in the URL, e.g.
+/static/script.js?v=0123456789abcdef, so a browser can cache them for a year:
+when a file changes, so does the URL on the page.
+'''
+
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+from email.utils import formatdate
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY = 'identity'
+GZIP = 'gzip'
+BROTLI = 'br'
+
+# The encodings that we compress to, in order of preference
+COMPRESSORS = ([(BROTLI, lambda data: brotli.compress(data, quality=9))] if brotli else []) + [
+    (GZIP, lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+    ]
+
+ETAG_DIGITS = 16
+
+VERSION_PARAM = 'v'
+
+# The page itself is checked with the clock every time, since the clock renders it
+NO_CACHE = 'no-cache'
+
+# For static files whose URL has their current ETag, which changes with the file
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# For static files asked for by name alone
+STATIC_CACHE = 'public, max-age=3600'
+
+_STATIC_URL = re.compile(r'/static/(?P<name>[\w.-]+)')
+
+
+class Asset():
+    ''' A file, held in memory with its compressed versions
+    '''
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, path, render=None):
+        '''
+        path:   The file
+        render: A function that takes the file's contents (bytes) and returns the body to serve
+        '''
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self._render = render
+        self._key = None
+        self.mtime = None
+        self.etag = None
+        self.encodings = {}  # encoding -> body
+
+    def refresh(self, key=None):
+        ''' Load the file if it, or key, has changed since it was loaded.
+            Return False if the file doesn't exist.
+        '''
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+
+        key = (stat.st_mtime_ns, stat.st_size, key)
+
+        if key != self._key:
+            with open(self.path, 'rb') as fil:
+                data = fil.read()
+
+            if self._render is not None:
+                data = self._render(data)
+
+            self.mtime = int(stat.st_mtime)
+            self.etag = hashlib.sha1(data).hexdigest()[:ETAG_DIGITS]
+            self.encodings = {IDENTITY: data}
+
+            for encoding, compress in COMPRESSORS:
+                compressed = compress(data)
+
+                if len(compressed) < len(data):
+                    self.encodings[encoding] = compressed
+
+            self._key = key
+
+        return True
+
+
+class WebAssets():
+    ''' The settings page and the static files
+    '''
+
+    def __init__(self, body_file, static_dir, title):
+        '''
+        body_file:  The settings page template, which has a {title}
+        static_dir: The directory of static files
+        title:      The page title
+        '''
+        self.static_dir = static_dir
+        self.title = title
+        self._static = {}  # name -> Asset
+        self._body = Asset(body_file, self._render_body)
+
+    def load(self):
+        ''' Load all the files. This takes a while on a Pi Zero, so run it off the event loop.
+        '''
+        try:
+            names = os.listdir(self.static_dir)
+        except OSError:
+            names = []
+
+        for name in names:
+            self.static(name)
+
+        self.body()
+
+    def static(self, name):
+        ''' Return the static file called name, or None if there isn't one
+        '''
+        asset = self._static.get(name)
+
+        if asset is None:
+            if name.startswith('.') or os.sep in name:
+                return None
+
+            asset = Asset(os.path.join(self.static_dir, name))
+
+        if not asset.refresh():
+            self._static.pop(name, None)
+            return None
+
+        self._static[name] = asset
+        return asset
+
+    def body(self):
+        ''' Return the settings page, or None if it's missing
+        '''
+        # The page has the static files' ETags in it, so it changes when they do
+        versions = tuple(
+            (name, asset.etag) for name, asset in sorted(self._static.items()) if asset.refresh())
+
+        return self._body if self._body.refresh(versions) else None
+
+    def _render_body(self, data):
+        ''' Fill in the page title and the versions of the static files
+        '''
+        def _versioned(match):
+            asset = self._static.get(match.group('name'))
+
+            if asset is None:
+                return match.group(0)
+
+            return '{}?{}={}'.format(match.group(0), VERSION_PARAM, asset.etag)
+
+        text = data.decode().format(title=self.title)
+        return _STATIC_URL.sub(_versioned, text).encode()
+
+
+def _accepted_encodings(header):
+    ''' Return the encodings accepted by an Accept-Encoding header
+    '''
+    accepted = set()
+
+    for item in header.split(','):
+        encoding, _, params = item.strip().partition(';')
+        quality = params.strip().partition('=')[2] if params.strip().startswith('q=') else '1'
+
+        try:
+            if float(quality) > 0:
+                accepted.add(encoding.strip().lower())
+        except ValueError:
+            pass
+
+    return accepted
+
+
+def _is_not_modified(request, etag, mtime):
+    ''' Does a conditional request already have this version?
+    '''
+    if_none_match = request.headers.get('If-None-Match')
+
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    if_modified_since = request.if_modified_since
+    return if_modified_since is not None and mtime <= if_modified_since.timestamp()
+
+
+def respond(request, asset, cache_control):
+    ''' Return an aiohttp response for an asset, compressed if the browser accepts it
+    '''
+    from aiohttp import web #pylint: disable=import-outside-toplevel
+
+    accepted = _accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding = next(
+        (encoding for encoding, _ in COMPRESSORS
+         if encoding in accepted and encoding in asset.encodings),
+        IDENTITY)
+
+    # Each encoding is a different representation, so it has its own ETag
+    etag = '"{}{}"'.format(asset.etag, '' if encoding == IDENTITY else '-' + encoding)
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(asset.mtime, usegmt=True),
+        'Cache-Control': cache_control,
+        'Vary': 'Accept-Encoding',
+        }
+
+    if _is_not_modified(request, etag, asset.mtime):
+        return web.Response(status=304, headers=headers)
+
+    if encoding != IDENTITY:
+        headers['Content-Encoding'] = encoding
+
+    is_text = asset.content_type.startswith('text/') or asset.content_type.endswith('javascript')
+
+    return web.Response(
+        body=asset.encodings[encoding],
+        content_type=asset.content_type,
+        charset='utf-8' if is_text else None,
+        headers=headers)
+
+
+def static_cache_control(request, asset):
+    ''' Return the Cache-Control for a static file, which depends on whether the URL has its ETag
+    '''
+    return IMMUTABLE if request.query.get(VERSION_PARAM) == asset.etag else STATIC_CACHE
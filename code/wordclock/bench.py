@@ -0,0 +1,367 @@
+'''
+Benchmark the render path for every clock face configuration.
+
+Each config/config_*.py is benchmarked in its own process, because the
+configuration registers its words when it is imported. The clock runs on the
+simulated hardware, and each display mode is driven frame by frame: a frame is
+one step of the mode plus one compositor frame.
+
+The results are printed as json:
+
+    {"version": ..., "python": ..., "machine": ..., "frames": ...,
+     "configs": {"ht": {"startup": {...}, "modes": {"write_clock": {...}, ...}}}}
+
+Times are in microseconds, except for startup times, which are in seconds.
+init_poems is timed twice: cold, building the poem cache, and warm, reading it.
+
+The clock's cache and state files are redirected to a temporary directory, so
+the benchmark doesn't disturb a clock running on the same machine, and every
+config starts from the same empty caches.
+'''
+
+import os
+import sys
+import json
+import asyncio
+import glob
+import time
+import shutil
+import tempfile
+import platform
+import datetime
+import importlib.util
+import subprocess
+import tracemalloc
+import traceback
+from contextlib import redirect_stdout
+from argparse import ArgumentParser, SUPPRESS
+
+import wordclock
+
+DEFAULT_FRAMES = 500
+
+# The number of frames traced for allocations, which is much slower than timing them
+ALLOC_FRAMES = 100
+
+PERCENTILES = [50, 90, 99]
+
+# A Sunday, which is also the demo mode's day
+BENCH_DAY = datetime.datetime(2021, 3, 7)
+
+_PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(wordclock.__file__)))
+DEFAULT_CONFIG_DIR = os.path.join(_PACKAGE_PARENT, 'config')
+
+
+def parse_args():
+    ''' Parse command line args
+    '''
+    parser = ArgumentParser(
+        prog='wc-bench',
+        description='Benchmark the Word Clock render path')
+
+    parser.add_argument(
+        'configs',
+        nargs='*',
+        help='The config files to benchmark (default: {}/config_*.py)'.format(DEFAULT_CONFIG_DIR))
+
+    parser.add_argument(
+        '--frames',
+        type=int,
+        default=DEFAULT_FRAMES,
+        help='The number of frames to time in each mode')
+
+    parser.add_argument(
+        '--output',
+        help='Write the results to a file as well as stdout')
+
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        default=False,
+        help='Show the output of the benchmarked clocks')
+
+    parser.add_argument(
+        '--run',
+        help=SUPPRESS) # Used internally to benchmark one config in a child process
+
+    args = parser.parse_args()
+
+    if not args.configs and not args.run:
+        args.configs = sorted(glob.glob(os.path.join(DEFAULT_CONFIG_DIR, 'config_*.py')))
+
+    return args
+
+
+def config_name(path):
+    ''' Return the name of a config file: config_ht.py -> ht
+    '''
+    return os.path.splitext(os.path.basename(path))[0].replace('config_', '', 1)
+
+
+def percentiles(values):
+    ''' Return a summary of a list of values
+    '''
+    if not values:
+        return {}
+
+    values = sorted(values)
+    summary = {
+        'p{}'.format(percentile): values[min(len(values) - 1, len(values) * percentile // 100)]
+        for percentile in PERCENTILES}
+    summary['max'] = values[-1]
+    summary['mean'] = sum(values) / len(values)
+    return {key: round(value, 1) for key, value in summary.items()}
+
+
+def load_config(path):
+    ''' Import a config file as wordclock.config
+    '''
+    spec = importlib.util.spec_from_file_location('wordclock.config', path)
+    config = importlib.util.module_from_spec(spec)
+    sys.modules['wordclock.config'] = config
+    spec.loader.exec_module(config)
+    wordclock.config = config
+    return config
+
+
+def make_frames(clock, wc):
+    ''' Return a function for each mode that draws one frame
+    '''
+    #pylint: disable=too-many-locals
+    compositor = clock.compositor
+    start = BENCH_DAY.replace(tzinfo=clock.timezone)
+    minutes = {'clock': 0, 'sun': 0}
+
+    def _write_clock():
+        clock.display_mode = wc.DisplayMode.CLOCK
+        now_minute = start + datetime.timedelta(minutes=minutes['clock'])
+        minutes['clock'] += 1
+        clock.write_clock(now_minute)
+        compositor.render_frame()
+
+    def _write_sun():
+        now_minute = start + datetime.timedelta(minutes=minutes['sun'])
+        minutes['sun'] += 1
+        clock.write_sun(now_minute)
+
+    names = list(wc.config.BIRTHDAYS.values())
+    birthday_name = names[0] if names else wc.config.HAPPY
+
+    def _job(make_job, mode):
+        jobs = []
+
+        def _frame():
+            # The jobs run for as long as these are set, but the other modes reset them
+            clock.display_mode = mode
+            clock.do_poem = True
+            clock.do_birthday = True
+            clock.birthday_name = birthday_name
+
+            if not jobs:
+                jobs.append(make_job())
+
+            next(jobs[0])
+            compositor.render_frame()
+
+        return _frame
+
+    clock.set_day(start)
+
+    return {
+        'write_clock': _write_clock,
+        'write_sun': _write_sun,
+        'display_poem': _job(clock.display_poem, wc.DisplayMode.CLOCK),
+        'display_birthday': _job(clock.display_birthday, wc.DisplayMode.CLOCK),
+        'display_random': _job(clock.display_random, wc.DisplayMode.RANDOM_WORDS),
+        'display_demo': _job(clock.display_demo, wc.DisplayMode.DEMO),
+        }
+
+
+def bench_mode(clock, frame, n_frames):
+    ''' Time frames of one mode, then trace the allocations of some more
+    '''
+    strip = clock.compositor.strip
+    clock.compositor.clear()
+    n_shows = strip.n_shows
+    latencies = []
+
+    for _ in range(n_frames):
+        start = time.perf_counter()
+        frame()
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    n_shows = strip.n_shows - n_shows
+    peaks = []
+    retained = 0
+
+    tracemalloc.start()
+
+    for _ in range(min(n_frames, ALLOC_FRAMES)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        frame()
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        retained += current - before
+
+    tracemalloc.stop()
+
+    return {
+        'frames': n_frames,
+        'latency_us': percentiles(latencies),
+        'shows': n_shows,
+        'shows_per_frame': round(n_shows / n_frames, 3) if n_frames else 0,
+        'peak_alloc_bytes': percentiles(peaks),
+        'retained_bytes_per_frame': round(retained / len(peaks), 1) if peaks else 0,
+        }
+
+
+def redirect_files(files_dir):
+    ''' Point the clock's cache and state files into files_dir.
+        The timezone cache is copied, so known locations don't need a lookup.
+    '''
+    #pylint: disable=import-outside-toplevel,protected-access
+    from wordclock import poems, suncalendar, tzcache, magnetometer
+
+    timezones_file = os.path.join(files_dir, os.path.basename(tzcache._CACHE_FILE))
+
+    if os.path.isfile(tzcache._CACHE_FILE):
+        shutil.copyfile(tzcache._CACHE_FILE, timezones_file)
+
+    tzcache._CACHE_FILE = timezones_file
+    poems._CACHE_FILE = os.path.join(files_dir, os.path.basename(poems._CACHE_FILE))
+    suncalendar.CALENDAR_FILE = os.path.join(
+        files_dir, os.path.basename(suncalendar.CALENDAR_FILE))
+    magnetometer._COMPASS_FILE = os.path.join(
+        files_dir, os.path.basename(magnetometer._COMPASS_FILE))
+
+
+def run_one(path, n_frames):
+    ''' Benchmark one config in this process, and return the results
+    '''
+    with tempfile.TemporaryDirectory(prefix='wc-bench-') as files_dir:
+        return run_one_in(path, n_frames, files_dir)
+
+
+def run_one_in(path, n_frames, files_dir):
+    ''' Benchmark one config, with the clock's files in files_dir
+    '''
+    #pylint: disable=import-outside-toplevel
+    startup = {}
+
+    start = time.perf_counter()
+    load_config(path)
+    startup['config_import'] = time.perf_counter() - start
+
+    redirect_files(files_dir)
+
+    from wordclock import poems
+
+    start = time.perf_counter()
+    poems.init_poems()
+    startup['init_poems_cold'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    poem_sampler = poems.init_poems()
+    startup['init_poems_warm'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from wordclock import wc
+    startup['wc_import'] = time.perf_counter() - start
+
+    wc.LAST_FRAME_FILE = os.path.join(files_dir, os.path.basename(wc.LAST_FRAME_FILE))
+
+    sys.argv = ['wc', '--simulate', '--daemon']
+    start = time.perf_counter()
+    clock = wc.Main()
+    startup['main_init'] = time.perf_counter() - start
+
+    clock.poem_sampler = poem_sampler
+
+    # Measure the render path, not the simulator's recording of the frames
+    clock.hardware.pixels.record = False
+
+    # Use the config's location and its timezone, rather than the saved params
+    clock.params[wc.PARAM_LAT] = wc.config.LAT
+    clock.params[wc.PARAM_LON] = wc.config.LON
+    clock.set_timezone()
+
+    # Don't let a timezone lookup or a sun calendar build in the background compete
+    # with the benchmark
+    while clock.pending_timezone or clock.building_sun_calendar:
+        clock.loop.run_until_complete(asyncio.sleep(0.1))
+
+    clock.state = wc.State.WIFI_ACTIVE
+    clock.params[wc.PARAM_POEMS] = wc.POEMS_OFF
+    clock.brightness_factor = 0.5
+    modes = {}
+
+    for name, frame in make_frames(clock, wc).items():
+        try:
+            modes[name] = bench_mode(clock, frame, n_frames)
+        except Exception as err: #pylint: disable=broad-except
+            traceback.print_exc()
+            modes[name] = {'error': repr(err)}
+
+    return {
+        'words': len(wc.configdefs.ALL_WORDS),
+        'poem_paths': poem_sampler.n_paths,
+        'startup': {key: round(value, 4) for key, value in startup.items()},
+        'modes': modes,
+        }
+
+
+def run_child(path, n_frames, verbose):
+    ''' Benchmark one config in a child process
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [_PACKAGE_PARENT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+
+    result = subprocess.run(
+        [sys.executable, '-m', 'wordclock.bench', '--run', path, '--frames', str(n_frames)],
+        stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.DEVNULL,
+        env=env,
+        check=False)
+
+    if result.returncode:
+        return {'error': 'exit status {}'.format(result.returncode)}
+
+    return json.loads(result.stdout)
+
+
+def main():
+    ''' do it
+    '''
+    args = parse_args()
+
+    if args.run:
+        # The clock prints as it starts up, so keep stdout for the results
+        with redirect_stdout(sys.stderr):
+            results = run_one(args.run, args.frames)
+
+        print(json.dumps(results))
+        return
+
+    results = {
+        'version': wordclock.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'frames': args.frames,
+        'configs': {
+            config_name(path): run_child(path, args.frames, args.verbose)
+            for path in args.configs},
+        }
+
+    text = json.dumps(results, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as fil:
+            fil.write(text + '\n')
+
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
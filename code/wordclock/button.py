@@ -0,0 +1,160 @@
+'''
+Recognize button gestures: single, double, triple and quadruple presses, and
+long presses.
+
+The recognizer is a small state machine fed by button edges. Timers are armed
+on the event loop only while a gesture is in progress, so an idle button costs
+nothing.
+'''
+
+import logging
+from enum import Enum
+
+LOG = logging.getLogger(__name__)
+
+# The time after an edge before the button level is read, to let it settle
+SETTLE_SECONDS = 0.05
+
+# A gesture ends when the button has been up for this long
+GESTURE_SECONDS = 1
+
+# A single press held for at least this long is a long press
+LONG_PRESS_SECONDS = 3
+
+# Presses after this many in one gesture are ignored
+MAX_PRESSES = 4
+
+
+class Gesture(Enum):
+    ''' A completed button gesture
+    '''
+    PRESS = 1
+    DOUBLE_PRESS = 2
+    TRIPLE_PRESS = 3
+    QUAD_PRESS = 4
+    LONG_PRESS = 5
+
+
+class ButtonGestures():
+    ''' Turn button edges into gestures.
+        All methods must be called on the event loop.
+    '''
+    #pylint: disable=too-many-instance-attributes
+
+    def __init__(self, loop, is_pressed, on_gesture, on_change=None, debug=False):
+        '''
+        loop:       The event loop
+        is_pressed: A function that returns whether the button is down
+        on_gesture: Called with a Gesture when a gesture is complete
+        on_change:  Called with no arguments when a press, release or gesture is recorded
+        debug:      Log the button edges
+        '''
+        self._loop = loop
+        self._is_pressed = is_pressed
+        self._on_gesture = on_gesture
+        self._on_change = on_change
+        self.debug = debug
+
+        self.down_time = None # Time when the button was last pressed (None if not pressed)
+        self.presses = 0      # The number of presses so far in the current gesture
+        self.duration = 0     # The duration of the last press
+
+        self._edge_time = None
+        self._settle_handle = None
+        self._gesture_handle = None
+
+    @property
+    def active(self):
+        ''' Is a gesture in progress?
+        '''
+        return self.down_time is not None or self.presses > 0
+
+    def is_long(self, now):
+        ''' Is the current gesture a long press, so far?
+        '''
+        if self.down_time is not None and self.presses == 0:
+            return now - self.down_time >= LONG_PRESS_SECONDS
+
+        if self.down_time is None and self.presses == 1:
+            return self.duration >= LONG_PRESS_SECONDS
+
+        return False
+
+    def edge(self, now):
+        ''' Handle a button edge at time now. The level is read once it has settled.
+        '''
+        if self._settle_handle is None:
+            self._edge_time = now
+        else:
+            self._settle_handle.cancel()
+
+        self._settle_handle = self._loop.call_later(SETTLE_SECONDS, self._settled)
+
+    def _settled(self):
+        ''' Read the settled button level
+        '''
+        self._settle_handle = None
+        now = self._edge_time
+
+        if self._is_pressed():
+            self._press(now)
+        else:
+            self._release(now)
+
+    def _press(self, now):
+        ''' The button went down
+        '''
+        if self.down_time is not None:
+            return
+
+        self.down_time = now
+        self._cancel_gesture()
+
+        if self.debug:
+            LOG.debug('down %s', now)
+
+        self._changed()
+
+    def _release(self, now):
+        ''' The button went up
+        '''
+        if self.down_time is None:
+            return
+
+        self.duration = now - self.down_time
+        self.down_time = None
+        self.presses = min(MAX_PRESSES, self.presses + 1)
+
+        if self.debug:
+            LOG.debug('up %s %s %s', self.presses, now, self.duration)
+
+        self._cancel_gesture()
+        self._gesture_handle = self._loop.call_later(GESTURE_SECONDS, self._finish)
+        self._changed()
+
+    def _changed(self):
+        ''' Tell on_change that the gesture state changed
+        '''
+        if self._on_change is not None:
+            self._on_change()
+
+    def _cancel_gesture(self):
+        ''' Cancel the end of gesture timer
+        '''
+        if self._gesture_handle is not None:
+            self._gesture_handle.cancel()
+            self._gesture_handle = None
+
+    def _finish(self):
+        ''' The button has been up long enough to end the gesture
+        '''
+        self._gesture_handle = None
+
+        if self.presses == 1 and self.duration >= LONG_PRESS_SECONDS:
+            gesture = Gesture.LONG_PRESS
+        else:
+            gesture = Gesture(self.presses)
+
+        self.presses = 0
+        self._changed()
+        self._on_gesture(gesture)
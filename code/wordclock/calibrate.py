@@ -3,22 +3,35 @@ Calibrate the compass
 '''
 
 import time
-import board
-import busio
-from wordclock import magnetometer
+from wordclock import magnetometer, sensorhub, logs
 
 
 def main():
     ''' do it
     '''
-    i2c = busio.I2C(board.SCL, board.SDA)
-    compass = magnetometer.Magnetometer(i2c, verbose=True)
+    log_listener = logs.setup(debug=True)
+    sensors = sensorhub.SensorHub(
+        sensorhub.open_pi_bus(),
+        [spec for spec in sensorhub.pi_sensors() if spec.name != sensorhub.LIGHT],
+        verbose=True)
+    compass = magnetometer.Magnetometer(verbose=True)
+    sensors.start()
 
     try:
         while True:
-            result = compass.update(do_calibration=True, verbose=True)
-            print(result.orientation, int(result.angle))
+            result = compass.update(
+                sensors.latest(sensorhub.ACCELEROMETER),
+                sensors.latest(sensorhub.MAGNETOMETER),
+                do_calibration=True,
+                verbose=True)
+
+            if result.angle is not None:
+                print(result.orientation, int(result.angle))
+
             time.sleep(1)
 
     except KeyboardInterrupt:
+        sensors.stop()
+        compass.flush()
+        log_listener.stop()
         print('Done!')
@@ -0,0 +1,113 @@
+'''
+The compositor is the only writer to the LED strip.
+
+Display modes draw into their own layers and submit them. The compositor shows
+the highest priority layer that is submitted, covering the layers below it,
+and pushes to the strip at most once per frame, however many layers are
+submitted in that frame.
+'''
+
+from wordclock import framebuffer
+from wordclock.metrics import REGISTRY
+
+# The minimum time between pushes to the strip, in seconds
+MIN_FRAME_SECONDS = 0.02
+
+_COLOR_OFF = (0, 0, 0)
+
+_FRAME_TIME = REGISTRY.histogram('wordclock_frame_seconds')
+_SHOW_TIME = REGISTRY.histogram('wordclock_strip_show_seconds')
+
+
+class Compositor():
+    ''' Merge the layers into the strip's frame buffer
+    '''
+
+    def __init__(self, loop, strip, layer_names):
+        '''
+        loop:        The event loop
+        strip:       The framebuffer.FrameBuffer for the strip
+        layer_names: The names of the layers, from the lowest priority to the highest
+        '''
+        self._loop = loop
+        self.strip = strip
+        self.layers = {name: framebuffer.Frame(len(strip)) for name in layer_names}
+        self._priority = list(reversed(layer_names))
+        self._submitted = set()
+        self._handle = None
+        self._last_frame_time = None
+
+    @property
+    def brightness(self):
+        ''' The brightness factor (0..1) of the strip
+        '''
+        return self.strip.brightness
+
+    @brightness.setter
+    def brightness(self, factor):
+        # The new brightness is shown with the next frame. Call refresh() to show it now.
+        self.strip.brightness = factor
+
+    def top(self):
+        ''' Return the name of the highest priority submitted layer, or None
+        '''
+        for name in self._priority:
+            if name in self._submitted:
+                return name
+
+        return None
+
+    def submit(self, name):
+        ''' Show a layer, once it has been drawn, unless a higher priority layer covers it
+        '''
+        self._submitted.add(name)
+        self._schedule()
+
+    def withdraw(self, name):
+        ''' Stop showing a layer, revealing the layers below it
+        '''
+        if name in self._submitted:
+            self._submitted.remove(name)
+            self._schedule()
+
+    def clear(self):
+        ''' Stop showing all the layers, which turns the strip off
+        '''
+        self._submitted.clear()
+        self._schedule()
+
+    def refresh(self):
+        ''' Render a frame soon, e.g. to show a new brightness
+        '''
+        self._schedule()
+
+    def _schedule(self):
+        ''' Render a frame soon, if one isn't already scheduled
+        '''
+        if self._handle is None:
+            when = self._loop.time()
+
+            if self._last_frame_time is not None:
+                when = max(when, self._last_frame_time + MIN_FRAME_SECONDS)
+
+            self._handle = self._loop.call_at(when, self.render_frame)
+
+    def render_frame(self):
+        ''' Merge the layers into the frame buffer and push it to the strip
+        '''
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        with _FRAME_TIME.time():
+            top = self.top()
+
+            if top is None:
+                self.strip.fill(_COLOR_OFF)
+            else:
+                self.strip.load_frame(self.layers[top])
+
+            with _SHOW_TIME.time():
+                self.strip.show()
+
+        self._last_frame_time = self._loop.time()
@@ -3,32 +3,74 @@ Namedtuples used in the config files
 '''
 
 from collections import namedtuple
+from wordclock.framebuffer import pixel_runs
 
 ALL_WORDS = []
 
+# The clock face is a DIM x DIM grid of pixels, wired as one strip that
+# snakes up and down the columns, starting at the right.
+DIM = 12
+
+# The strip index of each face pixel, as PIXEL_MAP[x][y]
+PIXEL_MAP = [
+    [(DIM-1-x) * DIM + (DIM-1-y if x % 2 else y) for y in range(DIM)]
+    for x in range(DIM)
+    ]
+
+
 class Word:
-    ''' Defines a word on the clock face
+    ''' Defines a word on the clock face. Words are immutable.
     '''
-    #pylint: disable=too-few-public-methods
+    #pylint: disable=too-few-public-methods,too-many-instance-attributes
+
+    __slots__ = ('text', 'y', 'x', 'vertical', 'id', 'length', 'end_y', 'end_x', 'pixels', 'runs')
 
     def __init__(self, text, y, x, vertical=False):
         '''
-        text: The word text, used to calculate its length
+        text:     The word text, used to calculate its length
         y:        # The starting row
         x:        # The startin column
         vertical: # True if the word is vertical
-        after:    # A list of the words that appear after this word in the gripd
-        poems:    # A list of poems starting with this word
+        id:       # The word's index in ALL_WORDS
+        length:   # The number of letters in the word
+        end_y:    # The row after the word's last letter (y + 1 if horizontal)
+        end_x:    # The column after the word's last letter (x + 1 if vertical)
+        pixels:   # A tuple of the word's LED strip indices
+        runs:     # The pixels as contiguous (start, end) runs of strip indices
         '''
-        self.text = text
-        self.y = y #pylint: disable=invalid-name
-        self.x = x #pylint: disable=invalid-name
-        self.vertical = vertical
-        self.after = None
-        self.poems = None
+        length = len(text)
+
+        if vertical:
+            end_y, end_x = y + length, x + 1
+            pixels = tuple(PIXEL_MAP[x][y_i] for y_i in range(y, end_y))
+        else:
+            end_y, end_x = y + 1, x + length
+            pixels = tuple(PIXEL_MAP[x_i][y] for x_i in range(x, end_x))
+
+        set_attr = super().__setattr__
+        set_attr('text', text)
+        set_attr('y', y)
+        set_attr('x', x)
+        set_attr('vertical', vertical)
+        set_attr('id', len(ALL_WORDS))
+        set_attr('length', length)
+        set_attr('end_y', end_y)
+        set_attr('end_x', end_x)
+        set_attr('pixels', pixels)
+        set_attr('runs', pixel_runs(pixels))
 
         ALL_WORDS.append(self)
 
+    def __setattr__(self, name, value):
+        raise AttributeError('Word is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Word is immutable')
+
+    def __repr__(self):
+        #pylint: disable=no-member
+        return 'Word({!r}, {}, {}, {})'.format(self.text, self.y, self.x, self.vertical)
+
 
 # Defines a birthday
 #
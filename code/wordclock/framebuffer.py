@@ -0,0 +1,171 @@
+'''
+Off-screen frames, and the frame buffer for the LED strip
+'''
+
+BYTES_PER_PIXEL = 3
+
+# The gamma used to map a brightness factor to LED intensity. 1 scales the
+# intensity linearly with the factor. Around 2.2 makes equal steps of the
+# factor look like equal steps of brightness.
+DEFAULT_GAMMA = 1
+
+
+def make_brightness_table(factor, gamma=DEFAULT_GAMMA):
+    ''' Return a 256-byte translation table that scales a color channel by a
+        brightness factor (0..1).
+    '''
+    scale = factor ** gamma
+    return bytes(min(255, round(value * scale)) for value in range(256))
+
+
+def pixel_runs(indices):
+    ''' Return the strip indices as contiguous runs of (start, end) pairs, for Frame.set_runs()
+    '''
+    runs = []
+
+    for index in sorted(set(indices)):
+        if runs and runs[-1][1] == index:
+            runs[-1][1] = index + 1
+        else:
+            runs.append([index, index + 1])
+
+    return tuple((start, end) for start, end in runs)
+
+
+class Frame():
+    ''' A frame of pixel colors in a compact bytearray. Draw code renders into
+        frames instead of the strip itself.
+
+        Colors are stored at full brightness. Pixels set with set_full() are
+        marked to be shown at full brightness regardless of the brightness factor.
+    '''
+
+    def __init__(self, n_pixels):
+        self._n_pixels = n_pixels
+        self._frame = bytearray(n_pixels * BYTES_PER_PIXEL)
+        self._full = set()
+
+    def __len__(self):
+        return self._n_pixels
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._n_pixels:
+            raise IndexError(index)
+
+        offset = index * BYTES_PER_PIXEL
+        return tuple(self._frame[offset:offset + BYTES_PER_PIXEL])
+
+    def __setitem__(self, index, color):
+        offset = index * BYTES_PER_PIXEL
+        self._frame[offset:offset + BYTES_PER_PIXEL] = bytes(color)
+
+    def set_runs(self, runs, color):
+        ''' Set runs of pixels, from pixel_runs(), to the same color.
+            Each run is one slice assignment.
+        '''
+        color = bytes(color)
+        frame = self._frame
+
+        for start, end in runs:
+            frame[start * BYTES_PER_PIXEL:end * BYTES_PER_PIXEL] = color * (end - start)
+
+    def set_full(self, index, color):
+        ''' Set a pixel that is always shown at full brightness
+        '''
+        self[index] = color
+        self._full.add(index)
+
+    def fill(self, color):
+        ''' Set every pixel to a color
+        '''
+        self._frame[:] = bytes(color) * self._n_pixels
+        self._full.clear()
+
+    def copy(self):
+        ''' Return a copy of the frame, for load()
+        '''
+        return bytes(self._frame)
+
+    def load(self, frame):
+        ''' Replace the frame with a copy made by copy()
+        '''
+        self._frame[:] = frame
+        self._full.clear()
+
+    def load_frame(self, frame):
+        ''' Replace the frame with another Frame, including its full brightness pixels
+        '''
+        self._frame[:] = frame._frame #pylint: disable=protected-access
+        self._full = set(frame._full) #pylint: disable=protected-access
+
+
+class FrameBuffer(Frame):
+    ''' The frame that is pushed to the strip. show() pushes the frame only when
+        it differs from the last frame pushed, because every push is a blocking
+        transfer. It scales the whole frame by the brightness factor in one
+        pass, except for pixels set with set_full().
+    '''
+
+    def __init__(self, pixels, gamma=DEFAULT_GAMMA):
+        '''
+        pixels: The neopixel.NeoPixel strip, created with auto_write=False
+        gamma:  The brightness gamma (see DEFAULT_GAMMA)
+        '''
+        super().__init__(len(pixels))
+        self._pixels = pixels
+        self._shown = None
+        self._gamma = gamma
+        self._brightness = 1
+        self._brightness_table = None
+        self.n_shows = 0
+
+    @property
+    def brightness(self):
+        ''' The brightness factor (0..1)
+        '''
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, factor):
+        if factor != self._brightness:
+            self._brightness = factor
+            self._brightness_table = (
+                None if factor == 1 else make_brightness_table(factor, self._gamma))
+
+    def render(self):
+        ''' Return the frame as it will be pushed to the strip
+        '''
+        if self._brightness_table is None:
+            return bytes(self._frame)
+
+        rendered = self._frame.translate(self._brightness_table)
+
+        for index in self._full:
+            offset = index * BYTES_PER_PIXEL
+            rendered[offset:offset + BYTES_PER_PIXEL] = (
+                self._frame[offset:offset + BYTES_PER_PIXEL])
+
+        return bytes(rendered)
+
+    def show(self):
+        ''' Push the frame to the strip, if it changed since the last push.
+            Return True if the strip was updated.
+        '''
+        frame = self.render()
+        shown = self._shown
+
+        if frame == shown:
+            return False
+
+        pixels = self._pixels
+
+        for index, offset in enumerate(range(0, len(frame), BYTES_PER_PIXEL)):
+            end = offset + BYTES_PER_PIXEL
+
+            if shown is None or frame[offset:end] != shown[offset:end]:
+                pixels[index] = tuple(frame[offset:end])
+
+        pixels.show()
+        self._shown = frame
+        self.n_shows += 1
+        return True
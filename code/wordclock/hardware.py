@@ -0,0 +1,253 @@
+'''
+The hardware that the clock drives: the LED strip, the button, the I2C
+sensors and the wifi.
+
+PiHardware drives the real thing. SimHardware records frames in memory, takes
+simulated button presses and reads synthetic sensor values from a
+sensorhub.FakeBus, so that the clock can be run, profiled and benchmarked off
+the Pi. The backend is chosen with wc --simulate, or the WORDCLOCK_BACKEND
+environment variable.
+
+The Pi libraries are only imported when PiHardware is created.
+'''
+
+import os
+import re
+import asyncio
+import logging
+import subprocess
+from collections import deque
+from wordclock import sensorhub
+
+LOG = logging.getLogger(__name__)
+
+PI = 'pi'
+SIM = 'sim'
+BACKENDS = [PI, SIM]
+
+BACKEND_ENV = 'WORDCLOCK_BACKEND'
+
+PIN_BUTTON = 23
+
+WPA_SUPPLICANT_CONF_FILE = '/etc/wpa_supplicant/wpa_supplicant.conf'
+
+# The number of frames that the simulated strip remembers
+SIM_FRAME_HISTORY = 1000
+
+SIM_SERVER_IP = '127.0.0.1'
+
+
+def backend_name(simulate=False):
+    ''' Return the name of the backend selected by the --simulate flag or the environment
+    '''
+    if simulate:
+        return SIM
+
+    name = os.environ.get(BACKEND_ENV, PI)
+
+    if name not in BACKENDS:
+        raise ValueError('{} must be one of {}, not {!r}'.format(BACKEND_ENV, BACKENDS, name))
+
+    return name
+
+
+def create(name, n_pixels):
+    ''' Create a backend
+    '''
+    return SimHardware(n_pixels) if name == SIM else PiHardware(n_pixels)
+
+
+class PiHardware():
+    ''' The Raspberry Pi, its strip, button and sensors
+    '''
+    name = PI
+
+    def __init__(self, n_pixels):
+        #pylint: disable=import-outside-toplevel
+        import board
+        import neopixel
+        import RPi.GPIO as GPIO
+
+        self._gpio = GPIO
+        self.pixels = neopixel.NeoPixel(board.D18, n_pixels, auto_write=False)
+
+        GPIO.setup(PIN_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP) #pylint: disable=no-member
+
+    def watch_button(self, callback):
+        ''' Call callback(channel), on another thread, whenever the button changes
+        '''
+        self._gpio.add_event_detect(
+            PIN_BUTTON, self._gpio.BOTH, callback=callback, bouncetime=100)
+
+    def is_button_pressed(self):
+        ''' Is the button down? It pulls the pin low.
+        '''
+        return not self._gpio.input(PIN_BUTTON)
+
+    @staticmethod
+    def sensor_hub(verbose):
+        ''' Return a SensorHub for the I2C sensors
+        '''
+        return sensorhub.SensorHub(sensorhub.open_pi_bus(), sensorhub.pi_sensors(), verbose)
+
+    @staticmethod
+    def check_wifi(debug):
+        ''' Return our IP address on the wifi, or None if it's not connected
+        '''
+        matcher = re.compile(r'\s*inet\s+(?P<ip>\d+\.\d+\.\d+\.\d+).*broadcast')
+        output = subprocess.check_output(['ifconfig', 'wlan0']).decode()
+
+        for line in output.splitlines():
+            match = matcher.match(line)
+
+            if match:
+                if debug:
+                    LOG.debug(line)
+
+                return match.group('ip')
+
+        if debug:
+            LOG.debug('-- ifconfig output --\n%s', output)
+
+        return None
+
+    @staticmethod
+    def start_hotspot(debug):
+        ''' Switch to hotspot mode
+        '''
+        if debug:
+            LOG.info('starting hotspot')
+
+        try:
+            subprocess.check_call(['hotspot', 'start'])
+            result = True
+        except Exception as err: #pylint: disable=broad-except
+            LOG.error('Failed to start hotspot: %s', err)
+            result = False
+
+        return result
+
+    @staticmethod
+    def start_wifi(stop_hotspot):
+        ''' Start wifi
+        '''
+        try:
+            if stop_hotspot:
+                subprocess.check_call(['hotspot', 'stop'])
+
+            subprocess.check_call(['wpa_cli', '-i', 'wlan0', 'reconfigure'])
+
+        except Exception as err: #pylint: disable=broad-except
+            LOG.error('Exception starting wifi: %s', err)
+
+    @staticmethod
+    def write_wifi_config(ssid, password, keep_ssid=None):
+        ''' Replace the wifi network definitions, except keep_ssid, with ssid and password
+        '''
+        from wpasupplicantconf import WpaSupplicantConf #pylint: disable=import-outside-toplevel
+
+        with open(WPA_SUPPLICANT_CONF_FILE, 'r') as fil:
+            wpa = WpaSupplicantConf(fil)
+
+        for network in [ssid for ssid in wpa.networks() if ssid != keep_ssid]:
+            wpa.remove_network(network)
+
+        wpa.add_network(ssid, psk=f'"{password}"', key_mgmt='WPA-PSK')
+
+        with open(WPA_SUPPLICANT_CONF_FILE, 'w') as fil:
+            wpa.write(fil)
+
+
+class SimPixels():
+    ''' Stands in for neopixel.NeoPixel. Each show() records the frame, unless
+        record is False, e.g. so that the benchmark doesn't measure the recording.
+    '''
+
+    def __init__(self, n_pixels):
+        self._colors = [(0, 0, 0)] * n_pixels
+        self.frames = deque(maxlen=SIM_FRAME_HISTORY)
+        self.record = True
+        self.n_shows = 0
+
+    def __len__(self):
+        return len(self._colors)
+
+    def __getitem__(self, index):
+        return self._colors[index]
+
+    def __setitem__(self, index, color):
+        self._colors[index] = tuple(color)
+
+    def show(self):
+        ''' Record the frame
+        '''
+        if self.record:
+            self.frames.append(bytes(value for color in self._colors for value in color))
+
+        self.n_shows += 1
+
+
+class SimHardware():
+    ''' A simulated clock, with a connected wifi
+    '''
+    name = SIM
+
+    def __init__(self, n_pixels):
+        self.pixels = SimPixels(n_pixels)
+        self.bus = sensorhub.FakeBus()
+        self._button_callback = None
+        self._button_down = False
+        self.wifi_config = None
+
+    def watch_button(self, callback):
+        ''' Call callback(channel) whenever the button changes
+        '''
+        self._button_callback = callback
+
+    def is_button_pressed(self):
+        ''' Is the button down?
+        '''
+        return self._button_down
+
+    def set_button(self, pressed):
+        ''' Push or release the button
+        '''
+        if pressed != self._button_down:
+            self._button_down = pressed
+
+            if self._button_callback is not None:
+                self._button_callback(PIN_BUTTON)
+
+    async def press(self, seconds=0.1):
+        ''' Press the button for a while
+        '''
+        self.set_button(True)
+        await asyncio.sleep(seconds)
+        self.set_button(False)
+
+    def sensor_hub(self, verbose):
+        ''' Return a SensorHub for the simulated sensors
+        '''
+        return sensorhub.SensorHub(self.bus, sensorhub.fake_sensors(), verbose)
+
+    @staticmethod
+    def check_wifi(_debug):
+        ''' The simulated wifi is always connected
+        '''
+        return SIM_SERVER_IP
+
+    @staticmethod
+    def start_hotspot(_debug):
+        ''' Pretend to switch to hotspot mode
+        '''
+        return True
+
+    @staticmethod
+    def start_wifi(_stop_hotspot):
+        ''' Pretend to start wifi
+        '''
+
+    def write_wifi_config(self, ssid, password, keep_ssid=None):
+        ''' Remember the wifi settings instead of writing them
+        '''
+        self.wifi_config = (ssid, password, keep_ssid)
@@ -0,0 +1,117 @@
+'''
+Logging for the clock.
+
+Log records are put on a queue, and a background thread writes them to stdout
+(and so to the journal), so logging never waits on I/O on the event loop. The
+most recent records are also kept in memory, for the web server's /logs.
+
+Repeated warnings are rate limited: the same message from the same place is
+logged at most once every RATE_LIMIT_SECONDS, with a count of the messages that
+were dropped in between. Messages that differ only in their arguments count as
+the same message, unless they are given different rate_keys, e.g.
+
+    LOG.warning('Failed to read the %s', name, extra={'rate_key': name})
+'''
+
+import sys
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+
+# The number of records kept for /logs
+RECENT_RECORDS = 500
+
+RATE_LIMIT_SECONDS = 60
+
+# Records below this level are never rate limited
+RATE_LIMIT_LEVEL = logging.WARNING
+
+STREAM_FORMAT = '%(levelname)s %(name)s: %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    ''' Drop repeats of a warning within RATE_LIMIT_SECONDS
+    '''
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, seconds=RATE_LIMIT_SECONDS):
+        super().__init__()
+        self.seconds = seconds
+        self._lock = threading.Lock()
+        self._last = {} # key -> (time last logged, number dropped since)
+
+    def filter(self, record):
+        if record.levelno < RATE_LIMIT_LEVEL:
+            return True
+
+        key = (record.name, record.msg, getattr(record, 'rate_key', None))
+        now = time.monotonic()
+
+        with self._lock:
+            last_time, n_dropped = self._last.get(key, (None, 0))
+
+            if last_time is not None and now - last_time < self.seconds:
+                self._last[key] = (last_time, n_dropped + 1)
+                return False
+
+            self._last[key] = (now, 0)
+
+        if n_dropped:
+            record.msg = '{} ({} similar messages dropped)'.format(record.getMessage(), n_dropped)
+            record.args = None
+
+        return True
+
+
+class RecentHandler(logging.Handler):
+    ''' Keep the most recent records, as dicts
+    '''
+
+    def __init__(self, size=RECENT_RECORDS):
+        super().__init__()
+        self._records = deque(maxlen=size)
+
+    def emit(self, record):
+        self._records.append({
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            })
+
+    def records(self, level=logging.NOTSET, limit=None):
+        ''' Return the recent records at or above a level, oldest first
+        '''
+        records = [
+            record for record in list(self._records)
+            if logging.getLevelName(record['level']) >= level]
+
+        return records[-limit:] if limit else records
+
+
+# The records for /logs
+RECENT = RecentHandler()
+
+
+def setup(debug=False):
+    ''' Send the wordclock loggers' records through a queue to stdout and RECENT.
+        Return the QueueListener, which should be stopped on exit to flush the queue.
+    '''
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(STREAM_FORMAT))
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, stream, RECENT)
+
+    handler = QueueHandler(records)
+    handler.addFilter(RateLimitFilter())
+
+    logger = logging.getLogger('wordclock')
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.addHandler(handler)
+
+    listener.start()
+    return listener
@@ -1,19 +1,29 @@
 '''
-Manage the magnetometer
+Manage the magnetometer: turn accelerometer and magnetometer readings into a
+compass heading. The sensors themselves are read by the sensorhub.
 '''
 
 import os
-from collections import namedtuple, deque
+import time
+import datetime
+from collections import namedtuple
 import json
 import math
-import adafruit_mlx90393
-import qwiic_adxl313
-import geomag
+import logging
 
-COMPASS_SMOOTHING_DEQUE_LEN = 2
+LOG = logging.getLogger(__name__)
+
+# The number of compass samples averaged into a heading
+COMPASS_SMOOTHING_LEN = 4
 
 RADIAN_TO_DEGREE = 180 / math.pi
 
+# The minimum time between writes of the calibration file, in seconds
+CALIBRATION_FLUSH_SECONDS = 10
+
+# The lat/lon precision used for caching the magnetic declination
+DECLINATION_DIGITS = 2
+
 _COMPASS_FILE = '/var/wordclock/compass.json'
 
 _KEY_X = 'x'
@@ -53,20 +63,50 @@ _ORIENTATIONS = {
     AccelCoord(_KEY_Z, False): CompassAngle(FACE_UP, _KEY_X, _KEY_Y, 0), # from top
     }
 
-XYZ = namedtuple('XYZ', 'x y z')
+class HeadingFilter():
+    ''' Average the most recent compass headings, as unit vectors, so that
+        headings either side of north (e.g. 359 and 1) average to north rather than south.
+    '''
+
+    def __init__(self, length):
+        self._sines = [0.0] * length
+        self._cosines = [0.0] * length
+        self._next = 0
+        self._count = 0
+
+    def add(self, angle):
+        ''' Add a heading, in degrees. Return the average heading, in degrees (0..360).
+        '''
+        radians = angle / RADIAN_TO_DEGREE
+        self._sines[self._next] = math.sin(radians)
+        self._cosines[self._next] = math.cos(radians)
+        self._next = (self._next + 1) % len(self._sines)
+        self._count = min(self._count + 1, len(self._sines))
+
+        return self.mean()
+
+    def mean(self):
+        ''' Return the average heading, in degrees (0..360), or None if there are no headings
+        '''
+        if not self._count:
+            return None
+
+        return math.atan2(sum(self._sines), sum(self._cosines)) * RADIAN_TO_DEGREE % 360
+
 
 class Magnetometer():
     ''' Manage the magnetometer
     '''
-    #pylint: disable=too-few-public-methods
+    #pylint: disable=too-few-public-methods,too-many-instance-attributes
 
-    def __init__(self, i2c, verbose):
-        self._i2c = i2c
+    def __init__(self, verbose):
         self.verbose = verbose
-        self._magnetometer = None
-        self._accelerometer = None
         self._orientation = _ORIENTATIONS[_ACCEL_COORD_TOP_UP]
-        self._angle_history = deque()
+        self._heading_filter = HeadingFilter(COMPASS_SMOOTHING_LEN)
+        self._declination_key = None
+        self._declination = 0
+        self._calibration_dirty = False
+        self._calibration_flush_time = 0
 
         self._settings = _COMPASS_DEFAULTS
 
@@ -77,100 +117,76 @@ class Magnetometer():
                 except: #pylint: disable=bare-except
                     pass
 
-        self._init_devices()
-
-    def _init_devices(self):
-        ''' Lazy-init the magnetometer and accelerometer
-        '''
-        if self._magnetometer is None:
-            try:
-                self._magnetometer = adafruit_mlx90393.MLX90393(
-                    self._i2c, gain=adafruit_mlx90393.GAIN_5X)
-                if self.verbose:
-                    print('Initialized magnetometer', flush=True)
-            except Exception as err: #pylint: disable=broad-except
-                print('Failed to init the magnetometer:', str(err), flush=True)
-
-        if self._accelerometer is None:
-            try:
-                self._accelerometer = qwiic_adxl313.QwiicAdxl313()
-                self._accelerometer.measureModeOn()
-                if self.verbose:
-                    print('Initialized accelerometer', flush=True)
-            except Exception as err: #pylint: disable=broad-except
-                print('Failed to init the accelerometer:', str(err), flush=True)
-
-    def update(self, do_calibration=False, verbose=False, lat=None, lon=None):
-        ''' Update the compass position
+    def update(self, accel, mag_coords, do_calibration=False, verbose=False, lat=None, lon=None):
+        ''' Update the compass position from sensor readings.
+            accel: The latest accelerometer XYZ, or None
+            mag_coords: The latest magnetometer coordinates, or None
         '''
+        #pylint: disable=too-many-arguments,too-many-positional-arguments
         angle = None
-        self._init_devices()
-
-        if self._accelerometer is not None:
-            try:
-                if self._accelerometer.dataReady():
-                    self._accelerometer.readAccel()
 
-                    values = {
-                        abs(self._accelerometer.x): AccelCoord(_KEY_X, self._accelerometer.x >= 0),
-                        abs(self._accelerometer.y): AccelCoord(_KEY_Y, self._accelerometer.y >= 0),
-                        abs(self._accelerometer.z): AccelCoord(_KEY_Z, self._accelerometer.z >= 0),
-                        }
+        if accel is not None:
+            values = {
+                abs(accel.x): AccelCoord(_KEY_X, accel.x >= 0),
+                abs(accel.y): AccelCoord(_KEY_Y, accel.y >= 0),
+                abs(accel.z): AccelCoord(_KEY_Z, accel.z >= 0),
+                }
 
-                    max_abs = max(values.keys())
-                    self._orientation = _ORIENTATIONS[values[max_abs]]
+            max_abs = max(values.keys())
+            self._orientation = _ORIENTATIONS[values[max_abs]]
 
-                    if verbose:
-                        print(
-                            '{:06d}'.format(self._accelerometer.x),
-                            ' {: 06d}'.format(self._accelerometer.y),
-                            ' {: 06d}'.format(self._accelerometer.z),
-                            flush=True)
-
-                        print(self._orientation, max_abs)
+            if verbose:
+                LOG.debug(
+                    'accel %06d %06d %06d %s %s',
+                    accel.x, accel.y, accel.z, self._orientation, max_abs)
 
-            except Exception as err: #pylint: disable=broad-except
-                self._accelerometer = None
-                print('Failed to read the accelerometer:', str(err), flush=True)
+        if mag_coords is not None:
+            if do_calibration:
+                self._calibrate(mag_coords, verbose)
 
-        if self._magnetometer is not None:
-            try:
-                mag_coords = self._magnetometer.magnetic
+            adjusted = {
+                key: self._adjust(key, mag_coords[i])
+                for i, key in enumerate(_XYZ)
+                }
 
-                if do_calibration:
-                    self._calibrate(mag_coords, verbose)
+            new_angle = math.atan2(
+                adjusted[self._orientation.opposite],
+                adjusted[self._orientation.near]) * RADIAN_TO_DEGREE
 
-                adjusted = {
-                    key: self._adjust(key, mag_coords[i])
-                    for i, key in enumerate(_XYZ)
-                    }
+            declination = self._get_declination(lat, lon)
 
-                new_angle = math.atan2(
-                    adjusted[self._orientation.opposite],
-                    adjusted[self._orientation.near]) * RADIAN_TO_DEGREE
+            new_angle = (new_angle + self._orientation.offset + declination + 360) % 360
 
-                declination = (
-                    geomag.declination(dlat=lat, dlon=lon)
-                    if lat is not None and lon is not None
-                    else 0)
+            if verbose:
+                LOG.debug('heading %d %s %s %s', new_angle, adjusted, declination, mag_coords)
 
-                new_angle = (new_angle + self._orientation.offset + declination + 360) % 360
+            angle = round(self._heading_filter.add(new_angle)) % 360
 
-                if verbose:
-                    print(int(new_angle), adjusted, declination, mag_coords, flush=True)
+        return Orientation(angle, self._orientation.orientation)
 
-                self._angle_history.append(new_angle)
+    def invalidate_declination(self):
+        ''' Force the declination to be recalculated, e.g. because lat/lon changed
+        '''
+        self._declination_key = None
 
-                if len(self._angle_history) > COMPASS_SMOOTHING_DEQUE_LEN:
-                    self._angle_history.popleft()
+    def _get_declination(self, lat, lon):
+        ''' Return the magnetic declination at lat/lon.
+            The model changes slowly, so it is calculated at most once a day per location.
+        '''
+        if lat is None or lon is None:
+            return 0
 
-                angle = round(sum(self._angle_history) / len(self._angle_history))
+        key = (
+            round(lat, DECLINATION_DIGITS),
+            round(lon, DECLINATION_DIGITS),
+            datetime.date.today())
 
-            except Exception as err: #pylint: disable=broad-except
-                self._magnetometer = None
-                print('Failed to read the magnetometer:', str(err), flush=True)
+        if key != self._declination_key:
+            import geomag #pylint: disable=import-outside-toplevel
+            self._declination = geomag.declination(dlat=lat, dlon=lon)
+            self._declination_key = key
 
-        return Orientation(angle, self._orientation.orientation)
+        return self._declination
 
     def _calibrate(self, mag_coords, verbose):
         ''' Update calibration
@@ -178,11 +194,33 @@ class Magnetometer():
         changed = [self._calibrate_coord(key, mag_coords[i]) for i, key in enumerate(_XYZ)]
 
         if any(changed):
-            with open(_COMPASS_FILE, 'w') as fil:
-                fil.write(json.dumps(self._settings))
+            self._calibration_dirty = True
 
             if verbose:
-                print('updated calibration', flush=True)
+                LOG.debug('updated calibration')
+
+        if time.monotonic() - self._calibration_flush_time >= CALIBRATION_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        ''' Write the calibration file, if the calibration changed since it was last written.
+            The file is replaced atomically, so a crash can't leave it half written.
+        '''
+        if not self._calibration_dirty:
+            return
+
+        tmp_file = _COMPASS_FILE + '.tmp'
+
+        with open(tmp_file, 'w') as fil:
+            fil.write(json.dumps(self._settings))
+
+        os.replace(tmp_file, _COMPASS_FILE)
+
+        self._calibration_dirty = False
+        self._calibration_flush_time = time.monotonic()
+
+        if self.verbose:
+            LOG.debug('saved calibration')
 
     def _calibrate_coord(self, key, value):
         ''' Calibrate one coordinate
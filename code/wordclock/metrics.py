@@ -0,0 +1,143 @@
+'''
+In-process metrics: counters and histograms, served by the web server at
+/metrics in the Prometheus text format.
+
+The metrics are cheap to update: a counter is an integer, and a histogram is
+a list of bucket counts. Each metric is only updated by one thread, so there
+is no locking.
+'''
+
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# The default histogram bucket upper bounds, in seconds
+SECONDS_BUCKETS = (
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1, 2.5, 5, 10)
+
+
+def _format_labels(labels, **extra):
+    ''' Return labels in the text format, e.g. {sensor="light"}
+    '''
+    items = list(labels) + sorted(extra.items())
+
+    if not items:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(key, value) for key, value in items) + '}'
+
+
+class Counter():
+    ''' A count of events
+    '''
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        ''' Count events
+        '''
+        self.value += amount
+
+    def lines(self, name, labels):
+        ''' Return the counter in the text format
+        '''
+        return ['{}{} {}'.format(name, _format_labels(labels), self.value)]
+
+
+class Histogram():
+    ''' A distribution of values, e.g. durations in seconds
+    '''
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last count is for values above the buckets
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        ''' Record a value
+        '''
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    @contextmanager
+    def time(self):
+        ''' Record the time taken by a block of code
+        '''
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def lines(self, name, labels):
+        ''' Return the histogram in the text format
+        '''
+        lines = []
+        cumulative = 0
+
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            lines.append(
+                '{}_bucket{} {}'.format(name, _format_labels(labels, le=bound), cumulative))
+
+        lines.append('{}_sum{} {}'.format(name, _format_labels(labels), self.sum))
+        lines.append('{}_count{} {}'.format(name, _format_labels(labels), self.count))
+        return lines
+
+
+class Registry():
+    ''' A set of named metrics. A metric is created the first time it is asked for.
+    '''
+
+    def __init__(self):
+        self._metrics = {} # (name, labels) -> metric
+        self._types = {}   # name -> type name
+
+    def _get(self, cls, type_name, name, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+
+        if metric is None:
+            metric = self._metrics[key] = cls(**kwargs)
+            self._types[name] = type_name
+
+        return metric
+
+    def counter(self, name, **labels):
+        ''' Return a counter
+        '''
+        return self._get(Counter, 'counter', name, labels)
+
+    def histogram(self, name, buckets=SECONDS_BUCKETS, **labels):
+        ''' Return a histogram
+        '''
+        return self._get(Histogram, 'histogram', name, labels, buckets=buckets)
+
+    def text(self):
+        ''' Return all the metrics in the Prometheus text format
+        '''
+        lines = []
+        typed = set()
+
+        for (name, labels), metric in sorted(self._metrics.items(), key=lambda x: x[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, self._types[name]))
+
+            lines.extend(metric.lines(name, labels))
+
+        return '\n'.join(lines) + '\n'
+
+
+# The clock's metrics
+REGISTRY = Registry()
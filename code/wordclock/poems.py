@@ -0,0 +1,227 @@
+'''
+Make poems from the words on the clock face.
+
+Calculating which words can follow each word is expensive, so the results are
+cached in a file, keyed by a hash of the clock's words, and recalculated only
+when the words change. Poems are drawn from those lists on demand.
+'''
+
+import os
+import json
+import random
+import hashlib
+import logging
+from array import array
+from collections import deque
+from itertools import accumulate
+
+from wordclock import configdefs, wordindex
+
+LOG = logging.getLogger(__name__)
+
+_CACHE_FILE = '/var/wordclock/poems.cache'
+_CACHE_VERSION = 2
+
+# How many of the most recent poems PoemSampler won't repeat
+N_RECENT_POEMS = 1000
+
+# How many paths PoemSampler tries before giving up on finding a poem
+MAX_SAMPLE_TRIES = 100
+
+_KEY_VERSION = 'version'
+_KEY_WORDS = 'words'
+_KEY_AFTER = 'after'
+
+
+def is_after(word0, word1):
+    ''' Is word1 after word0 on the grid?
+    '''
+    if word0.vertical:
+        word0_end = word0.end_y
+
+        return (
+            word1.y >= word0.y and word1.y <= word0_end and word1.x > word0.x + 1
+            or word1.y > word0_end)
+
+    word0_end = word0.end_x
+
+    if word1.vertical:
+        return (
+            word1.y == word0.y and word1.x > word0_end
+            or word1.y == word0.y + 1 and (word1.x < word0.x - 1 or word1.x > word0_end)
+            or word1.y > word0.y + 1)
+
+    return (
+        word1.y == word0.y and word1.x > word0_end
+        or word1.y > word0.y)
+
+
+def words_key(words):
+    ''' Return a hash that identifies a list of words and their positions
+    '''
+    return hashlib.sha1(
+        json.dumps([(word.text, word.y, word.x, word.vertical) for word in words]).encode()
+        ).hexdigest()
+
+
+def calc_after(words):
+    ''' Calculate the words after each word.
+        Return a list of after lists, indexed by word id.
+    '''
+    index = wordindex.WordIndex(words)
+
+    return [
+        [word1 for word1 in index.after(word0) if word1.text != word0.text]
+        for word0 in words]
+
+
+def is_poem(word0, word2):
+    ''' Can word0 start a poem that ends with word2, given that the words are
+        linked by a word after word0 and before word2?
+    '''
+    return word2.text != 'a' and is_after(word0, word2)
+
+
+class PoemSampler():
+    ''' Draw random poems from the after lists, without enumerating every poem.
+
+        A poem is a path word0 -> word1 -> word2 through the after lists, where
+        word2 is also after word0 and isn't "a". Paths are drawn uniformly, by
+        choosing word0 weighted by the number of paths that start with it and word1
+        weighted by the length of its after list. Paths that aren't poems are
+        rejected, so every poem is equally likely.
+    '''
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, words, after):
+        '''
+        words: All the words, in id order
+        after: The words after each word, indexed by word id
+        '''
+        self._after = after
+        self._words = [word for word in words if after[word.id]]
+        self._recent = deque()
+        self._recent_set = set()
+
+        # For each word, the cumulative number of paths through each word in its after list
+        self._cum_paths = [
+            list(accumulate(len(after[word1.id]) for word1 in word_after))
+            for word_after in after
+            ]
+
+        self._cum_word_paths = list(
+            accumulate(self._cum_paths[word.id][-1] for word in self._words))
+
+        self.n_paths = self._cum_word_paths[-1] if self._cum_word_paths else 0
+
+    def sample(self, word0=None):
+        ''' Return a random poem, as a tuple of words, that hasn't been returned recently.
+            If word0 isn't None, return a poem that starts with it, which may be a
+            recent one, since a word may have only a few poems.
+            Return a recent poem if no other poem could be found, and None if there are no poems.
+        '''
+        if word0 is None:
+            if not self.n_paths:
+                return None
+        elif not self._after[word0.id] or not self._cum_paths[word0.id][-1]:
+            return None
+
+        repeat = None
+
+        for _ in range(MAX_SAMPLE_TRIES):
+            start = word0 or random.choices(self._words, cum_weights=self._cum_word_paths)[0]
+            word1 = random.choices(self._after[start.id], cum_weights=self._cum_paths[start.id])[0]
+            word2 = random.choice(self._after[word1.id])
+            poem = (start, word1, word2)
+
+            if is_poem(start, word2):
+                if word0 is None and poem in self._recent_set:
+                    repeat = poem
+                else:
+                    self._remember(poem)
+                    return poem
+
+        if repeat is not None:
+            self._remember(repeat)
+
+        return repeat
+
+    def _remember(self, poem):
+        ''' Remember a poem, so it isn't repeated soon
+        '''
+        self._recent.append(poem)
+        self._recent_set.add(poem)
+
+        if len(self._recent) > N_RECENT_POEMS:
+            self._recent_set.discard(self._recent.popleft())
+
+
+def read_cache(key, words):
+    ''' Read the after lists from the cache file.
+        Return None if there is no valid cache for these words.
+
+        The file is a line of json header, followed by the word indices of
+        every word's after list, as unsigned shorts.
+    '''
+    try:
+        with open(_CACHE_FILE, 'rb') as fil:
+            header = json.loads(fil.readline())
+
+            if header[_KEY_VERSION] != _CACHE_VERSION or header[_KEY_WORDS] != key:
+                return None
+
+            after_lens = header[_KEY_AFTER]
+            after_indices = array('H')
+            after_indices.fromfile(fil, sum(after_lens))
+
+    except Exception: #pylint: disable=broad-except
+        return None
+
+    after_words = list(map(words.__getitem__, after_indices))
+    after = []
+    begin = 0
+
+    for after_len in after_lens:
+        after.append(after_words[begin:begin + after_len])
+        begin += after_len
+
+    return after
+
+
+def write_cache(key, after):
+    ''' Write the after lists to the cache file
+    '''
+    header = {
+        _KEY_VERSION: _CACHE_VERSION,
+        _KEY_WORDS: key,
+        _KEY_AFTER: [len(word_after) for word_after in after],
+        }
+
+    after_indices = array('H', (word1.id for word_after in after for word1 in word_after))
+
+    try:
+        tmp_file = _CACHE_FILE + '.tmp'
+
+        with open(tmp_file, 'wb') as fil:
+            fil.write(json.dumps(header).encode() + b'\n')
+            after_indices.tofile(fil)
+
+        os.replace(tmp_file, _CACHE_FILE)
+
+    except OSError as err:
+        LOG.error('Failed to write the poem cache: %s', err)
+
+
+def init_poems():
+    ''' Calculate the words after each word.
+        Return a PoemSampler for drawing random poems.
+    '''
+    words = configdefs.ALL_WORDS
+    key = words_key(words)
+    after = read_cache(key, words)
+
+    if after is None:
+        after = calc_after(words)
+        write_cache(key, after)
+
+    return PoemSampler(words, after)
@@ -0,0 +1,119 @@
+'''
+A tickless scheduler for the display jobs.
+
+A job is a generator. Each step draws what it needs to and then yields the
+number of seconds until it next needs to run, or None to wait until it is
+woken. The scheduler keeps one timer on the event loop, set for the earliest
+deadline, so nothing wakes up unless some job is due. Jobs run one at a time,
+so they never race on the pixels.
+'''
+
+import logging
+from wordclock.metrics import REGISTRY
+
+LOG = logging.getLogger(__name__)
+
+
+class Scheduler():
+    ''' Run named jobs at their deadlines
+    '''
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._jobs = {}       # name -> generator
+        self._deadlines = {}  # name -> loop time, for jobs that are waiting for a deadline
+        self._handle = None
+        self._current = None  # The name of the job that is running, if any
+        self._metrics = {}    # name -> (steps counter, step time histogram)
+
+    def add(self, name, job):
+        ''' Add a job and run it as soon as possible, replacing any job with the same name
+        '''
+        self.remove(name)
+        self._jobs[name] = job
+
+        if name not in self._metrics:
+            self._metrics[name] = (
+                REGISTRY.counter('wordclock_job_steps_total', job=name),
+                REGISTRY.histogram('wordclock_job_step_seconds', job=name))
+
+        self.wake(name)
+
+    def remove(self, name):
+        ''' Remove a job
+        '''
+        job = self._jobs.pop(name, None)
+        self._deadlines.pop(name, None)
+
+        if job is not None and name != self._current:
+            job.close()
+
+    def is_running(self, name):
+        ''' Is there a job with this name?
+        '''
+        return name in self._jobs
+
+    def wake(self, name):
+        ''' Run a job as soon as possible
+        '''
+        if name in self._jobs:
+            self._deadlines[name] = self._loop.time()
+            self._arm()
+
+    def _arm(self):
+        ''' Set the timer for the earliest deadline
+        '''
+        if self._current is not None:
+            # _run_due() arms the timer when it is done
+            return
+
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+        if self._deadlines:
+            self._handle = self._loop.call_at(min(self._deadlines.values()), self._run_due)
+
+    def _run_due(self):
+        ''' Run the jobs whose deadlines have passed, earliest first
+        '''
+        self._handle = None
+        now = self._loop.time()
+        due = sorted(
+            (deadline, name) for name, deadline in self._deadlines.items() if deadline <= now)
+
+        for _, name in due:
+            if self._deadlines.get(name, now + 1) <= now:
+                del self._deadlines[name]
+                self._step(name)
+
+        self._arm()
+
+    def _step(self, name):
+        ''' Run one step of a job and record its next deadline
+        '''
+        job = self._jobs[name]
+        steps, step_time = self._metrics[name]
+        self._current = name
+        steps.inc()
+
+        try:
+            with step_time.time():
+                delay = next(job)
+
+        except StopIteration:
+            delay = None
+            self._jobs.pop(name, None)
+
+        except Exception: #pylint: disable=broad-except
+            LOG.exception('The %s job failed', name, extra={'rate_key': name})
+            delay = None
+            self._jobs.pop(name, None)
+
+        finally:
+            self._current = None
+
+        # The job may have been removed or replaced, or woken itself, while it ran
+        if delay is not None and self._jobs.get(name) is job:
+            deadline = self._loop.time() + max(0, delay)
+            self._deadlines[name] = min(deadline, self._deadlines.get(name, deadline))
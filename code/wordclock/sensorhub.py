@@ -0,0 +1,241 @@
+'''
+Read the I2C sensors: the ambient light sensor, the magnetometer and the
+accelerometer.
+
+A single SensorHub thread owns the bus and reads every sensor at its own rate,
+so no I2C call ever runs on the event loop. A sensor that fails to open or read
+is retried with exponential backoff. The latest value of each sensor is available
+from latest(), and subscribers are called on the event loop with each new value.
+A subscriber can also give a function that turns the value into what it
+wants, which runs on the hub thread, so that work stays off the event loop too.
+
+The sensors are described by SensorSpecs. pi_sensors() returns the real ones;
+fake_sensors() returns sensors that read from a FakeBus, for running without hardware.
+'''
+
+import time
+import heapq
+import logging
+import threading
+from collections import namedtuple
+from wordclock.metrics import REGISTRY
+
+LOG = logging.getLogger(__name__)
+
+LIGHT = 'light'
+MAGNETOMETER = 'magnetometer'
+ACCELEROMETER = 'accelerometer'
+
+LIGHT_SECONDS = 1
+COMPASS_SECONDS = 2
+
+# The delay before retrying a failed sensor doubles from MIN to MAX
+MIN_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 60
+
+XYZ = namedtuple('XYZ', 'x y z')
+
+SensorSpec = namedtuple(
+    'SensorSpec',
+    [
+        'name',     # The sensor name
+        'open',     # A function that takes the bus and returns the device
+        'read',     # A function that takes the device and returns a value, or None if not ready
+        'seconds',  # The time between reads
+    ])
+
+
+def open_pi_bus():
+    ''' Return the Raspberry Pi I2C bus
+    '''
+    #pylint: disable=import-outside-toplevel
+    import board
+    import busio
+
+    return busio.I2C(board.SCL, board.SDA)
+
+
+def pi_sensors():
+    ''' Return the specs of the real sensors
+    '''
+    #pylint: disable=import-outside-toplevel
+    import adafruit_veml7700
+    import adafruit_mlx90393
+    import qwiic_adxl313
+
+    def _open_magnetometer(bus):
+        return adafruit_mlx90393.MLX90393(bus, gain=adafruit_mlx90393.GAIN_5X)
+
+    def _open_accelerometer(_bus):
+        accelerometer = qwiic_adxl313.QwiicAdxl313()
+        accelerometer.measureModeOn()
+        return accelerometer
+
+    def _read_accelerometer(accelerometer):
+        if not accelerometer.dataReady():
+            return None
+
+        accelerometer.readAccel()
+        return XYZ(accelerometer.x, accelerometer.y, accelerometer.z)
+
+    return [
+        SensorSpec(LIGHT, adafruit_veml7700.VEML7700, lambda x: x.light, LIGHT_SECONDS),
+        SensorSpec(MAGNETOMETER, _open_magnetometer, lambda x: x.magnetic, COMPASS_SECONDS),
+        SensorSpec(ACCELEROMETER, _open_accelerometer, _read_accelerometer, COMPASS_SECONDS),
+        ]
+
+
+class FakeBus():
+    ''' Stands in for the I2C bus and its sensors. Set the values to be read, and
+        add sensor names to failing to make them fail.
+    '''
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, light=1000, magnetic=(20.0, 0.0, -40.0), accel=XYZ(0, -256, 0)):
+        self.values = {LIGHT: light, MAGNETOMETER: magnetic, ACCELEROMETER: accel}
+        self.failing = set()
+        self.n_reads = 0
+
+    def read(self, name):
+        ''' Return the value of a sensor
+        '''
+        self.n_reads += 1
+
+        if name in self.failing:
+            raise OSError('fake {} failure'.format(name))
+
+        return self.values[name]
+
+
+def fake_sensors():
+    ''' Return the specs of sensors that read from a FakeBus
+    '''
+    def _spec(name, seconds):
+        def _open(bus):
+            bus.read(name)
+            return bus
+
+        return SensorSpec(name, _open, lambda bus: bus.read(name), seconds)
+
+    return [
+        _spec(LIGHT, LIGHT_SECONDS),
+        _spec(MAGNETOMETER, COMPASS_SECONDS),
+        _spec(ACCELEROMETER, COMPASS_SECONDS),
+        ]
+
+
+class _Sensor():
+    ''' The state of one sensor
+    '''
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.device = None
+        self.backoff = 0
+        self.read_time = REGISTRY.histogram('wordclock_sensor_read_seconds', sensor=spec.name)
+        self.errors = REGISTRY.counter('wordclock_sensor_errors_total', sensor=spec.name)
+
+
+class SensorHub(threading.Thread):
+    ''' Read all the sensors on one thread
+    '''
+
+    def __init__(self, bus, specs, verbose=False):
+        '''
+        bus:     The I2C bus (or a FakeBus)
+        specs:   A list of SensorSpecs
+        verbose: Print when sensors are opened
+        '''
+        super().__init__(name='sensors', daemon=True)
+        self.bus = bus
+        self.verbose = verbose
+        self._sensors = [_Sensor(spec) for spec in specs]
+        self._values = {}
+        self._subscribers = []
+        self._stop_event = threading.Event()
+
+    def latest(self, name):
+        ''' Return the latest value read from a sensor, or None
+        '''
+        return self._values.get(name)
+
+    def subscribe(self, name, callback, loop, transform=None):
+        ''' Call callback(value) on an event loop whenever a sensor is read.
+            If transform isn't None, call callback(transform(value)) instead,
+            with transform called on the hub thread.
+        '''
+        self._subscribers.append((name, callback, loop, transform))
+
+    def stop(self):
+        ''' Stop reading
+        '''
+        self._stop_event.set()
+
+    def run(self):
+        ''' Read each sensor when it is due
+        '''
+        now = time.monotonic()
+        schedule = [(now, i) for i in range(len(self._sensors))]
+
+        while schedule:
+            due, i = schedule[0]
+
+            if self._stop_event.wait(max(0, due - time.monotonic())):
+                break
+
+            sensor = self._sensors[i]
+            heapq.heapreplace(schedule, (time.monotonic() + self.poll(sensor), i))
+
+    def poll(self, sensor):
+        ''' Open the sensor if necessary, and read it.
+            Return the time until it should be polled again.
+        '''
+        spec = sensor.spec
+
+        try:
+            if sensor.device is None:
+                sensor.device = spec.open(self.bus)
+
+                if self.verbose:
+                    LOG.info('Initialized %s', spec.name)
+
+            with sensor.read_time.time():
+                value = spec.read(sensor.device)
+
+        except Exception as err: #pylint: disable=broad-except
+            sensor.errors.inc()
+            opened = sensor.device is not None
+            sensor.device = None
+            sensor.backoff = min(MAX_BACKOFF_SECONDS, max(MIN_BACKOFF_SECONDS, sensor.backoff * 2))
+
+            LOG.warning(
+                'Failed to %s the %s: %s (retry in %ss)',
+                'read' if opened else 'init', spec.name, err, sensor.backoff,
+                extra={'rate_key': spec.name})
+
+            return sensor.backoff
+
+        sensor.backoff = 0
+
+        if value is not None:
+            self._values[spec.name] = value
+
+            for name, callback, loop, transform in self._subscribers:
+                if name == spec.name:
+                    self._publish(callback, loop, transform, value)
+
+        return spec.seconds
+
+    @staticmethod
+    def _publish(callback, loop, transform, value):
+        ''' Send a value to a subscriber
+        '''
+        if transform is not None:
+            try:
+                value = transform(value)
+            except Exception: #pylint: disable=broad-except
+                LOG.exception('Failed to process a sensor value')
+                return
+
+        loop.call_soon_threadsafe(callback, value)
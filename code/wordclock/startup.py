@@ -0,0 +1,46 @@
+'''
+Time the phases of starting the clock, for wc --profile-startup
+'''
+
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile():
+    ''' Record how long each startup phase takes, and when it ends
+    '''
+
+    def __init__(self, start):
+        '''
+        start: The time.perf_counter() at which startup began
+        '''
+        self.start = start
+        self.phases = [] # (name, seconds, seconds since start)
+
+    @contextmanager
+    def phase(self, name):
+        ''' Time a phase
+        '''
+        begin = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.phases.append((name, end - begin, end - self.start))
+
+    def mark(self, name):
+        ''' Record a milestone, e.g. the first frame
+        '''
+        self.phases.append((name, None, time.perf_counter() - self.start))
+
+    def report(self):
+        ''' Return the phases as a table
+        '''
+        lines = ['{:<20} {:>9} {:>9}'.format('startup phase', 'seconds', 'at')]
+
+        for name, seconds, at_seconds in self.phases:
+            lines.append('{:<20} {:>9} {:>9.3f}'.format(
+                name, '' if seconds is None else '{:.3f}'.format(seconds), at_seconds))
+
+        return '\n'.join(lines)
@@ -0,0 +1,168 @@
+'''
+A calendar of sunrise and sunset times, calculated in one pass for a range of
+days and saved to a file, so that the clock doesn't have to run the astral
+solver every midnight.
+
+The file is a line of json header, followed by eight doubles per day: the
+morning and then the evening SunTimes, as timestamps. Days on which astral
+can't calculate the times (e.g. near the poles) are stored as NaNs.
+'''
+
+import os
+import json
+import math
+import mmap
+import struct
+import datetime
+from collections import namedtuple
+import astral
+from astral import sun
+
+SunTimes = namedtuple('SunTimes', 'blue_start blue_end golden_start golden_end')
+
+CALENDAR_FILE = '/var/wordclock/sun-calendar.bin'
+
+# The number of days that build() calculates
+CALENDAR_DAYS = 2 * 366
+
+# load() rejects a calendar that ends less than this many days from today
+MIN_DAYS_LEFT = 30
+
+_VERSION = 1
+_DAY = struct.Struct('<8d')
+
+_KEY_VERSION = 'version'
+_KEY_LAT = 'lat'
+_KEY_LON = 'lon'
+_KEY_TIMEZONE = 'timezone'
+_KEY_FIRST_DAY = 'first_day'
+_KEY_N_DAYS = 'n_days'
+
+
+def calc_times(observer, day, direction, timezone):
+    ''' Use astral to calculate the sunrise or sunset times for a day
+    '''
+    blue = sun.blue_hour(observer=observer, date=day, direction=direction, tzinfo=timezone)
+    golden = sun.golden_hour(observer=observer, date=day, direction=direction, tzinfo=timezone)
+
+    return SunTimes(
+        blue[0].timestamp(), blue[1].timestamp(),
+        golden[0].timestamp(), golden[1].timestamp())
+
+
+class SunCalendar():
+    ''' A memory-mapped calendar file
+    '''
+
+    def __init__(self, path, header, mapped, offset):
+        self.path = path
+        self.header = header
+        self.first_day = datetime.date.fromordinal(header[_KEY_FIRST_DAY])
+        self.n_days = header[_KEY_N_DAYS]
+        self._mapped = mapped
+        self._offset = offset
+
+    def matches(self, lat, lon, timezone, today):
+        ''' Does the calendar apply to a location, and cover today and the next MIN_DAYS_LEFT?
+        '''
+        first = self.first_day.toordinal()
+
+        return (
+            self.header[_KEY_LAT] == lat and
+            self.header[_KEY_LON] == lon and
+            self.header[_KEY_TIMEZONE] == str(timezone) and
+            first <= today.toordinal() <= first + self.n_days - MIN_DAYS_LEFT)
+
+    def get_times(self, day, direction):
+        ''' Return the SunTimes for a day and direction.
+            Return None if the day isn't in the calendar, or has no times.
+        '''
+        index = day.toordinal() - self.first_day.toordinal()
+
+        if not 0 <= index < self.n_days:
+            return None
+
+        values = _DAY.unpack_from(self._mapped, self._offset + index * _DAY.size)
+
+        if direction == astral.SunDirection.RISING:
+            times = SunTimes(*values[:4])
+        else:
+            times = SunTimes(*values[4:])
+
+        return None if any(math.isnan(value) for value in times) else times
+
+    def close(self):
+        ''' Unmap the file
+        '''
+        self._mapped.close()
+
+
+def load(lat, lon, timezone, today, path=None):
+    ''' Map the calendar file (default CALENDAR_FILE).
+        Return None if it doesn't exist or doesn't match the location and day.
+    '''
+    path = path or CALENDAR_FILE
+
+    try:
+        with open(path, 'rb') as fil:
+            header = json.loads(fil.readline())
+
+            if header[_KEY_VERSION] != _VERSION:
+                return None
+
+            offset = fil.tell()
+            mapped = mmap.mmap(fil.fileno(), 0, access=mmap.ACCESS_READ)
+
+    except Exception: #pylint: disable=broad-except
+        return None
+
+    calendar = SunCalendar(path, header, mapped, offset)
+
+    if len(mapped) < offset + calendar.n_days * _DAY.size or not calendar.matches(
+            lat, lon, timezone, today):
+        calendar.close()
+        return None
+
+    return calendar
+
+
+def build(lat, lon, timezone, today, path=None, n_days=CALENDAR_DAYS):
+    ''' Calculate a calendar starting yesterday, write it to a file
+        (default CALENDAR_FILE), and return the mapped calendar.
+    '''
+    #pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    path = path or CALENDAR_FILE
+    observer = astral.LocationInfo(latitude=lat, longitude=lon).observer
+    first_day = today - datetime.timedelta(days=1)
+    days = bytearray(n_days * _DAY.size)
+    no_times = (math.nan,) * 4
+
+    for index in range(n_days):
+        day = first_day + datetime.timedelta(days=index)
+        values = []
+
+        for direction in [astral.SunDirection.RISING, astral.SunDirection.SETTING]:
+            try:
+                values.extend(calc_times(observer, day, direction, timezone))
+            except ValueError:
+                values.extend(no_times)
+
+        _DAY.pack_into(days, index * _DAY.size, *values)
+
+    header = {
+        _KEY_VERSION: _VERSION,
+        _KEY_LAT: lat,
+        _KEY_LON: lon,
+        _KEY_TIMEZONE: str(timezone),
+        _KEY_FIRST_DAY: first_day.toordinal(),
+        _KEY_N_DAYS: n_days,
+        }
+
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as fil:
+        fil.write(json.dumps(header).encode() + b'\n')
+        fil.write(days)
+
+    os.replace(tmp_path, path)
+    return load(lat, lon, timezone, today, path)
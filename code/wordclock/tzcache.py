@@ -0,0 +1,109 @@
+'''
+Look up the timezone at a latitude and longitude.
+
+TimezoneFinder loads large polygon datasets, so it is created only when a
+location isn't in the cache file, used in an executor thread, and released
+after it has been idle for a while.
+'''
+
+import os
+import json
+import logging
+import threading
+
+LOG = logging.getLogger(__name__)
+
+_CACHE_FILE = '/var/wordclock/timezones.json'
+
+# Seconds after the last lookup before the TimezoneFinder is released
+IDLE_RELEASE_SECONDS = 60
+
+# Locations are cached to this many decimal places (about 11 meters)
+_KEY_DIGITS = 4
+
+
+def _key(lat, lon):
+    ''' Return the cache key for a location
+    '''
+    return '{},{}'.format(round(lat, _KEY_DIGITS), round(lon, _KEY_DIGITS))
+
+
+class TimezoneCache():
+    ''' A persistent cache of timezone names, backed by a lazily created TimezoneFinder
+    '''
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._finder = None
+        self._finder_lock = threading.Lock()
+        self._release_handle = None
+        self._cache = {}
+
+        if os.path.isfile(_CACHE_FILE):
+            with open(_CACHE_FILE, 'r') as fil:
+                try:
+                    self._cache.update(json.loads(fil.read()))
+                except: #pylint: disable=bare-except
+                    pass
+
+    def get_cached(self, lat, lon):
+        ''' Return the cached timezone name for a location, or None if it isn't cached
+        '''
+        return self._cache.get(_key(lat, lon))
+
+    async def lookup(self, lat, lon):
+        ''' Return the timezone name for a location, finding it in an executor
+            thread if it isn't cached.
+        '''
+        tz_name = self.get_cached(lat, lon)
+
+        if tz_name is None:
+            tz_name = await self._loop.run_in_executor(None, self._find, lat, lon)
+            self._schedule_release()
+
+            if tz_name is not None:
+                self._cache[_key(lat, lon)] = tz_name
+                self._write_cache()
+
+        return tz_name
+
+    def _find(self, lat, lon):
+        ''' Find a timezone with the TimezoneFinder, creating it if necessary.
+            This runs in an executor thread.
+        '''
+        with self._finder_lock:
+            if self._finder is None:
+                from timezonefinder import TimezoneFinder #pylint: disable=import-outside-toplevel
+                self._finder = TimezoneFinder()
+
+            return self._finder.timezone_at(lat=lat, lng=lon)
+
+    def _schedule_release(self):
+        ''' Release the finder if it isn't used again soon
+        '''
+        if self._release_handle is not None:
+            self._release_handle.cancel()
+
+        self._release_handle = self._loop.call_later(IDLE_RELEASE_SECONDS, self._release)
+
+    def _release(self):
+        ''' Release the finder and its datasets
+        '''
+        self._release_handle = None
+
+        with self._finder_lock:
+            self._finder = None
+
+    def _write_cache(self):
+        ''' Write the cache file
+        '''
+        try:
+            tmp_file = _CACHE_FILE + '.tmp'
+
+            with open(tmp_file, 'w') as fil:
+                fil.write(json.dumps(self._cache, indent=2, sort_keys=True))
+
+            os.replace(tmp_file, _CACHE_FILE)
+
+        except OSError as err:
+            LOG.error('Failed to write the timezone cache: %s', err)
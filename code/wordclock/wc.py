@@ -9,33 +9,57 @@ https://ajax.googleapis.com/ajax/libs/jquery/1.10.1/jquery.min.js
 '''
 #pylint: disable=too-many-lines
 
+import time
+
+# When this module started to import, for --profile-startup
+IMPORT_START_TIME = time.perf_counter()
+
+#pylint: disable=wrong-import-position
 import os
 from enum import Enum
 from collections import namedtuple, deque
-import subprocess
-import re
 import datetime
-import time
+import importlib
 from argparse import ArgumentParser
 import random
 import math
 from bisect import bisect_left
+from array import array
 import json
-import traceback
 import asyncio
+import logging
+import signal
 import pytz
 import astral
-from astral import sun
-from aiohttp import web
-from timezonefinder import TimezoneFinder
-import neopixel
-import RPi.GPIO as GPIO
-import board
-import busio
-import adafruit_veml7700
-from wpasupplicantconf import WpaSupplicantConf
-
-from wordclock import __version__, config, magnetometer, configdefs
+
+from wordclock import (
+    __version__, config, magnetometer, configdefs, framebuffer, poems, suncalendar, tzcache,
+    sensorhub, button, scheduler, compositor, hardware, startup, metrics, logs,
+    assets)
+#pylint: enable=wrong-import-position
+
+LOG = logging.getLogger(__name__)
+
+
+class _LazyModule():
+    ''' A module that isn't imported until it is used
+    '''
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+
+        return getattr(self._module, attr)
+
+
+# aiohttp takes longer to import than the rest of the clock put together, so it
+# is imported when the web server starts, after the clock is showing.
+web = _LazyModule('aiohttp.web')
 
 DO_CALIBRATION = False
 DO_RANDOM_WORD_POEMS = True
@@ -48,8 +72,6 @@ HOTSPOT_IP = '10.0.0.1'
 COMPASS_JITTER_THRESHOLD = 10
 AMBIENT_SMOOTHING_DEQUE_LEN = 5
 
-LONG_PRESS_DURATION = 3
-
 # These times are set so that the total time for one poem is 15
 # seconds, allowing exactly 4 iterations in a minute.
 #
@@ -62,6 +84,35 @@ POEM_DURATION = 15     # This causes the inter-poem time to be about 1.5 seconds
 
 RANDOM_WORD_PAUSE = 1
 
+# How often the clock face is saved, to be shown right away when the clock restarts
+LAST_FRAME_SAVE_SECONDS = 10 * 60
+
+# Stop futzing when the web page hasn't pinged for this many seconds
+FUTZ_TIMEOUT = 5
+
+# How long to wait for the sensor hub to stop, on exit
+SENSOR_STOP_SECONDS = 2
+
+# How often to measure how late the event loop runs things, in seconds
+LOOP_LAG_SECONDS = 5
+
+_LOOP_LAG = metrics.REGISTRY.histogram('wordclock_loop_lag_seconds')
+_WIFI_CHECK_TIME = metrics.REGISTRY.histogram('wordclock_wifi_check_seconds')
+
+# The names of the display jobs
+JOB_STATUS = 'status'
+JOB_CLOCK = 'clock'
+JOB_POEM = 'poem'
+JOB_BIRTHDAY = 'birthday'
+JOB_MODE = 'mode'         # The job for the current display mode, other than the clock
+
+# The display layers, from the lowest priority to the highest
+LAYER_CLOCK = 'clock'
+LAYER_POEM = 'poem'       # Poems and random words
+LAYER_MARQUEE = 'marquee' # Birthdays
+LAYER_STATUS = 'status'   # Status and button press lights
+LAYERS = [LAYER_CLOCK, LAYER_POEM, LAYER_MARQUEE, LAYER_STATUS]
+
 SETTINGS_TITLE = '{} Clock'.format(config.CLOCK_NAME)
 
 def scale_color(color, factor):
@@ -111,63 +162,6 @@ RANDOM_COLORS = [
     ]
 
 
-def is_after(word0, word1):
-    ''' Is word1 after word0 on the grid?
-    '''
-    l_word0 = len(word0.text)
-
-    if word0.vertical:
-        word0_end = word0.y + l_word0
-
-        return (
-            word1.y >= word0.y and word1.y <= word0_end and word1.x > word0.x + 1
-            or word1.y > word0_end)
-
-    word0_end = word0.x + l_word0
-
-    if word1.vertical:
-        return (
-            word1.y == word0.y and word1.x > word0_end
-            or word1.y == word0.y + 1 and (word1.x < word0.x - 1 or word1.x > word0_end)
-            or word1.y > word0.y + 1)
-
-    return (
-        word1.y == word0.y and word1.x > word0_end
-        or word1.y > word0.y)
-
-
-def is_after_no_dup(word0, word1):
-    ''' Is word1 after word0 on the grid, and are the words not the same?
-    '''
-    return word0.text != word1.text and is_after(word0, word1)
-
-
-def init_poems():
-    ''' Calculate poems.
-        Store a list of poems that start with each word.
-        Return a list of all poems, shuffled.
-    '''
-    # All words ordered by their position in the grid, left to right, top to bottom.
-    all_words_in_grid_order = sorted(configdefs.ALL_WORDS, key=lambda x: (x.y, x.x))
-
-    for word0 in all_words_in_grid_order:
-        word0.after = [word1 for word1 in all_words_in_grid_order if is_after_no_dup(word0, word1)]
-
-    for word0 in all_words_in_grid_order:
-        word0.poems = [
-            (word0, word1, word2)
-            for word1 in word0.after
-            for word2 in word1.after
-            if is_after(word0, word2) and word2.text != 'a']
-
-    poems = [poem for word in all_words_in_grid_order for poem in word.poems]
-    random.shuffle(poems)
-    return poems
-
-
-# All four-word poems, in random order
-ALL_POEMS = init_poems()
-
 class State(Enum):
     ''' The operational state
     '''
@@ -199,8 +193,10 @@ PORT_HTTP = 80
 
 FILES_DIR = '/var/wordclock'
 PARAMS_FILE = os.path.join(FILES_DIR, 'params.json')
+LAST_FRAME_FILE = os.path.join(FILES_DIR, 'last-frame.bin')
 WIFI_PARAMS_FILE = os.path.join(FILES_DIR, 'wifi.json')
 BODY_FILE = os.path.join(FILES_DIR, 'website', 'body.html')
+STATIC_DIR = os.path.join(FILES_DIR, 'website', 'static')
 
 # These keys must agree with the corresponding controls on the web page.
 PARAM_SSID = 'ssid'
@@ -253,17 +249,11 @@ MAX_BRIGHTNESS_CONFIG = DisplayConfig('Max Brightness', PARAM_MAX_BRIGHTNESS, 0,
 
 DISPLAY_ERROR_FMT = '<li>The {param} must be between {min} and {max}</li>'
 
-PIN_BUTTON = 23
-PIN_PIXELS = board.D18
-
-DIM = 12
+DIM = configdefs.DIM
 BORDER_DIM = 24 if config.VERSION_2 else 12
 N_PIXELS = DIM*DIM + BORDER_DIM*4
 
-PIXEL_MAP = [
-    [(DIM-1-x) * DIM + (DIM-1-y if x % 2 else y) for y in range(DIM)]
-    for x in range(DIM)
-    ]
+PIXEL_MAP = configdefs.PIXEL_MAP
 
 MARQEE_PIXELS = (
     [PIXEL_MAP[x_i][0] for x_i in range(DIM - 1)] +
@@ -272,6 +262,7 @@ MARQEE_PIXELS = (
     [PIXEL_MAP[0][y_i] for y_i in range(DIM - 1, 0, -1)])
 
 
+
 DOW_PIXELS_X = 0
 DOW_PIXELS_Y = DIM - 1
 
@@ -289,6 +280,10 @@ ASTRAL_PIXELS_RANGE = range(
 GROUND_PIXELS_RANGE = range(
     BORDER_PIXELS_BASE + SKY_PIXELS_LEN, BORDER_PIXELS_BASE + BORDER_PIXELS_LEN)
 
+ASTRAL_PIXELS_RUNS = framebuffer.pixel_runs(ASTRAL_PIXELS_RANGE)
+GROUND_PIXELS_RUNS = framebuffer.pixel_runs(GROUND_PIXELS_RANGE)
+BORDER_PIXELS_RUNS = framebuffer.pixel_runs(range(BORDER_PIXELS_BASE, BORDER_PIXELS_END))
+
 MARQEE_LIGHT_DELTA = 4
 
 SR_BEGIN = 'sr_begin'
@@ -351,20 +346,34 @@ def angle_to_pixel(angle):
     return bisect_left(ASTRAL_ANGLES, angle)
 
 
-WPA_SUPPLICANT_CONF_FILE = '/etc/wpa_supplicant/wpa_supplicant.conf'
 
 
-SunTimes = namedtuple('SunTimes', 'blue_start blue_end golden_start golden_end')
+SunTimes = suncalendar.SunTimes
 Sun = namedtuple('Sun', 'sun_pixel, sun_color, sky_color ground_color')
 
 # The altitude of the sun at the end/start of golden hour
 DAYLIGHT_ANGLE = 6
 
+# The number of bytes per minute in the AstralInfo colors table (sun, sky and ground)
+SUN_TABLE_COLORS_LEN = 9
+
 class AstralInfo():
     ''' Everything about the sun
     '''
-    def __init__(self, lat, lon, timezone, debug):
+    #pylint: disable=too-many-instance-attributes
+
+    def __init__(self, lat, lon, timezone, debug, use_table=True, calendar=None):
+        '''
+        use_table: If True, set_day() calculates the sun for every minute of the day,
+                   and get_sun() looks it up
+        calendar:  A suncalendar.SunCalendar to get sunrise/sunset times from, or None
+        '''
+        #pylint: disable=too-many-arguments,too-many-positional-arguments
         self.debug = debug
+        self.use_table = use_table
+        self.calendar = calendar
+        self.lat = lat
+        self.lon = lon
         self.observer = astral.LocationInfo(latitude=lat, longitude=lon).observer
         self.timezone = timezone
 
@@ -372,6 +381,10 @@ class AstralInfo():
         self.evening_times = None
         self.daylight_seconds = None
 
+        self.table_start = None
+        self.table_positions = None
+        self.table_colors = None
+
         self.set_day(datetime.datetime.now(timezone).date())
 
     def set_day(self, today):
@@ -383,11 +396,76 @@ class AstralInfo():
         self.daylight_seconds = self.evening_times.golden_start - self.morning_times.golden_end
 
         if self.debug:
-            print('daylight seconds', self.daylight_seconds, flush=True)
+            LOG.debug('daylight seconds %s', self.daylight_seconds)
+
+        if self.use_table:
+            self.set_table(today)
+
+    def set_table(self, today):
+        ''' Calculate the sun for every minute of a day.
+
+            For each minute, table_positions holds the sun pixel, counting from the
+            sunrise end of the sky, or -1 if the sun isn't shown. table_colors holds
+            the sun, sky and ground colors.
+        '''
+        self.table_start = None
+
+        start = self.timezone.localize(datetime.datetime.combine(today, datetime.time()))
+        end = self.timezone.localize(
+            datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time()))
+
+        start = start.timestamp()
+        positions = array('h')
+        colors = array('B')
+
+        for timestamp in range(int(start), int(end.timestamp()), 60):
+            sun_params = self.calc_sun(timestamp, SUNRISE_LEFT)
+
+            if sun_params.sun_pixel is None:
+                positions.append(-1)
+                colors.extend(COLOR_OFF)
+            else:
+                positions.append(sun_params.sun_pixel - ASTRAL_PIXELS_BASE)
+                colors.extend(sun_params.sun_color)
+
+            colors.extend(sun_params.sky_color)
+            colors.extend(sun_params.ground_color)
+
+        self.table_positions = positions
+        self.table_colors = colors
+        self.table_start = start
 
     def get_sun(self, timestamp, orientation):
         ''' Given a timestamp, return the params for drawing the clock border
         '''
+        if self.table_start is not None:
+            seconds = timestamp - self.table_start
+
+            if seconds % 60 == 0 and 0 <= seconds < len(self.table_positions) * 60:
+                return self.lookup_sun(int(seconds // 60), orientation)
+
+        return self.calc_sun(timestamp, orientation)
+
+    def lookup_sun(self, minute, orientation):
+        ''' Return the params for drawing the clock border from the table
+        '''
+        position = self.table_positions[minute]
+        offset = minute * SUN_TABLE_COLORS_LEN
+        colors = self.table_colors[offset:offset + SUN_TABLE_COLORS_LEN]
+
+        if position < 0:
+            sun_pixel = sun_color = None
+        else:
+            sun_pixel = (
+                ASTRAL_PIXELS_BASE + position if orientation == SUNRISE_LEFT
+                else ASTRAL_PIXELS_SUNSET - position)
+            sun_color = tuple(colors[0:3])
+
+        return Sun(sun_pixel, sun_color, tuple(colors[3:6]), tuple(colors[6:9]))
+
+    def calc_sun(self, timestamp, orientation):
+        ''' Given a timestamp, calculate the params for drawing the clock border
+        '''
         if orientation == SUNRISE_LEFT:
             sunrise_pixel = ASTRAL_PIXELS_BASE
             sunset_pixel = ASTRAL_PIXELS_SUNSET
@@ -487,28 +565,27 @@ class AstralInfo():
             (180 - DAYLIGHT_ANGLE * 2))
 
     def get_times(self, today, direction):
-        ''' Get sunrise/sunset times
+        ''' Get sunrise/sunset times, from the sun calendar if it has them
         '''
-        blue = sun.blue_hour(
-            observer=self.observer, date=today, direction=direction, tzinfo=self.timezone)
+        times = self.calendar.get_times(today, direction) if self.calendar else None
 
-        golden = sun.golden_hour(
-            observer=self.observer, date=today, direction=direction, tzinfo=self.timezone)
+        if times is None:
+            times = suncalendar.calc_times(self.observer, today, direction, self.timezone)
 
         if self.debug:
+            blue_start, blue_end, golden_start, golden_end = [
+                datetime.datetime.fromtimestamp(timestamp, self.timezone) for timestamp in times]
+
             if direction == astral.SunDirection.RISING:
-                print('blue start', blue[0], flush=True)
-                print('gold start', golden[0], flush=True)
-                print('gold end  ', golden[1], flush=True)
+                LOG.debug(
+                    'blue start %s, gold start %s, gold end %s',
+                    blue_start, golden_start, golden_end)
             else:
-                print()
-                print('gold start', golden[0])
-                print('blue start', blue[0])
-                print('blue end  ', blue[1], flush=True)
+                LOG.debug(
+                    'gold start %s, blue start %s, blue end %s',
+                    golden_start, blue_start, blue_end)
 
-        return SunTimes(
-            blue[0].timestamp(), blue[1].timestamp(),
-            golden[0].timestamp(), golden[1].timestamp())
+        return times
 
 
 async def get_request_data(request):
@@ -517,7 +594,7 @@ async def get_request_data(request):
     try:
         data = await request.json()
     except: #pylint: disable=bare-except
-        print('invalid mode received from browser')
+        LOG.warning('invalid mode received from browser')
         data = dict()
 
     return data
@@ -548,6 +625,24 @@ def parse_args():
         default=False,
         help='Run poem mode continuously')
 
+    parser.add_argument(
+        '--simulate',
+        action='store_true',
+        default=False,
+        help='Simulate the hardware (or set {}={})'.format(hardware.BACKEND_ENV, hardware.SIM))
+
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=PORT_HTTP,
+        help='The web server port')
+
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        default=False,
+        help='Print the time taken by each phase of starting up')
+
     return parser.parse_args()
 
 
@@ -558,90 +653,221 @@ class Main():
 
     def __init__(self):
         self.args = parse_args()
+        self.log_listener = logs.setup(self.args.debug)
+        self.profile = startup.StartupProfile(IMPORT_START_TIME)
+        self.profile.mark('imported')
+        self.loop = asyncio.get_event_loop()
+        self.scheduler = scheduler.Scheduler(self.loop)
         self.state = State.STARTING
         self.display_mode = DisplayMode.CLOCK
         self.is_on = True
         self.timezone = pytz.utc
         self.today = None
         self.astral_info = None
+        self.building_sun_calendar = False
+        self.pending_timezone = None  # The (lat, lon) whose timezone is being looked up
         self.birthday_name = None
         self.do_birthday = False
-        self.light_sensor = None
         self.server_ip = 'unknown'
 
         self.futzing = False
         self.last_ping = None
 
-        self.loop = asyncio.get_event_loop()
         self.start_hotspot_event = asyncio.Event()
+        self.timezones = tzcache.TimezoneCache(self.loop)
         self.http_runner = None
-
-        self.button_down_time = None # Time when the button was last pressed (None if not pressed)
-        self.button_up_time = None   # Time when the button was last released
-        self.button_presses = 0
-        self.button_duration = 0     # The duration of the last button press
-
-        #pylint: disable=no-member
-        GPIO.setup(PIN_BUTTON, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.add_event_detect(PIN_BUTTON, GPIO.BOTH, callback=self.handle_button, bouncetime=100)
-        #pylint: enable=no-member
-
-        self.i2c = busio.I2C(board.SCL, board.SDA)
-        self.init_light_sensor()
-        self.compass = magnetometer.Magnetometer(self.i2c, not self.args.daemon)
+        self.web_assets = assets.WebAssets(BODY_FILE, STATIC_DIR, SETTINGS_TITLE)
+        self.poem_sampler = None  # Draws random poems, once init_poems has run
+        self.last_frame_save_time = time.monotonic()
+
+        with self.profile.phase('hardware'):
+            self.hardware = hardware.create(hardware.backend_name(self.args.simulate), N_PIXELS)
+            self.button = button.ButtonGestures(
+                self.loop, self.hardware.is_button_pressed, self.handle_gesture,
+                on_change=lambda: self.scheduler.wake(JOB_STATUS), debug=self.args.debug)
+            self.hardware.watch_button(self.handle_button)
+
+            self.sensors = self.hardware.sensor_hub(not self.args.daemon)
+            self.sensors.subscribe(sensorhub.LIGHT, self.handle_light, self.loop)
+            self.sensors.subscribe(
+                sensorhub.MAGNETOMETER, self.handle_compass, self.loop, self.read_compass)
+            self.compass = magnetometer.Magnetometer(not self.args.daemon)
+
+            self.compositor = compositor.Compositor(
+                self.loop,
+                framebuffer.FrameBuffer(self.hardware.pixels),
+                LAYERS)
+            self.pixels = self.compositor.layers[LAYER_CLOCK] # The layer being drawn
+
+        with self.profile.phase('last frame'):
+            self.show_last_frame()
 
         self.cur_ambient = 0
+        self.light_history = deque(maxlen=AMBIENT_SMOOTHING_DEQUE_LEN)
         self.brightness_factor = 1
         self.orientation = magnetometer.Orientation(0, magnetometer.TOP_UP)
         self.cur_angle = self.orientation.angle
         self.sunrise = SUNRISE_LEFT
 
         self.random_minute = 0
-        self.poem_index = 0
         self.do_poem = False
+        self.time_frames = {}
+
+        with self.profile.phase('params'):
+            self.read_params()
+
 
-        self.read_params()
+    @property
+    def state(self):
+        ''' The operational state
+        '''
+        return self._state
 
-        self.pixels = neopixel.NeoPixel(PIN_PIXELS, N_PIXELS, auto_write=False)
+    @state.setter
+    def state(self, state):
+        self._state = state #pylint: disable=attribute-defined-outside-init
+        self.scheduler.wake(JOB_STATUS)
 
-        print(f'words={len(configdefs.ALL_WORDS)} poems={len(ALL_POEMS)}')
+    @property
+    def brightness_factor(self):
+        ''' The current brightness (0..1), applied to the whole frame when it is shown
+        '''
+        return self.compositor.brightness
 
+    @brightness_factor.setter
+    def brightness_factor(self, factor):
+        self.compositor.brightness = factor
 
     def main(self):
         ''' do it
         '''
-        self.loop.run_until_complete(self.run_http_server())
-        self.loop.create_task(self.manage_button())
+        self.loop.create_task(self.co_start_deferred())
         self.loop.create_task(self.co_check_wifi())
-        self.loop.create_task(self.display_status())
-        self.loop.create_task(self.update_compass())
-        self.loop.create_task(self.display_clock())
+        self.loop.create_task(self.co_measure_loop_lag())
+        self.scheduler.add(JOB_STATUS, self.display_status())
+        self.sensors.start()
+        self.scheduler.add(JOB_CLOCK, self.display_clock())
         self.loop.create_task(self.handle_start_hotspot_event())
 
         if self.params.get(PARAM_SSID):
             self.state = State.WIFI_INIT
         else:
-            self.state = State.HOTSPOT if start_hotspot(not self.args.daemon) else State.ERROR
+            self.state = (
+                State.HOTSPOT if self.hardware.start_hotspot(not self.args.daemon) else State.ERROR)
+
+        # systemd stops the service with SIGTERM
+        self.loop.add_signal_handler(signal.SIGTERM, self.loop.stop)
 
         try:
             self.loop.run_forever()
         except KeyboardInterrupt:
             pass
 
-        self.loop.run_until_complete(self.http_runner.cleanup())
+        self.shutdown()
 
-    def init_light_sensor(self):
-        ''' Initialize the ambient light sensor
+    def shutdown(self):
+        ''' Save what should survive a restart, and stop. Each step is done even
+            if an earlier one fails.
         '''
-        if self.light_sensor is None:
+        steps = [
+            ('stop the sensors', self.stop_sensors),
+            ('save the compass calibration', self.compass.flush),
+            ('save the last frame', self.save_last_frame),
+            ('stop the web server', self.stop_http_server),
+            ]
+
+        for name, step in steps:
             try:
-                self.light_sensor = adafruit_veml7700.VEML7700(self.i2c)
+                step()
+            except Exception: #pylint: disable=broad-except
+                LOG.exception('Failed to %s', name)
 
-                if not self.args.daemon:
-                    print('Initialized light sensor', flush=True)
+        # Last, so that everything above is logged
+        self.log_listener.stop()
 
-            except Exception as err: #pylint: disable=broad-except
-                print('Failed to init light sensor:', str(err), flush=True)
+    def stop_sensors(self):
+        ''' Stop the sensor hub
+        '''
+        # The compass is updated on the sensor hub's thread, so let it finish
+        # before the compass calibration is saved
+        self.sensors.stop()
+        self.sensors.join(SENSOR_STOP_SECONDS)
+
+    def stop_http_server(self):
+        ''' Stop the web server, if it's running
+        '''
+        if self.http_runner is not None:
+            self.loop.run_until_complete(self.http_runner.cleanup())
+
+    async def co_start_deferred(self):
+        ''' Start the things that the clock face doesn't need, once it is showing
+        '''
+        await asyncio.sleep(0)
+
+        # The poems load on another thread while the web server starts, and
+        # whether or not it starts
+        poem_sampler = self.loop.run_in_executor(None, poems.init_poems)
+
+        with self.profile.phase('web server'):
+            try:
+                await self.run_http_server()
+            except Exception: #pylint: disable=broad-except
+                LOG.exception('Failed to start the web server')
+
+        with self.profile.phase('poems'):
+            try:
+                self.poem_sampler = await poem_sampler
+            except Exception: #pylint: disable=broad-except
+                LOG.exception('Failed to load the poems')
+            else:
+                LOG.info(
+                    'words=%d poem paths=%d',
+                    len(configdefs.ALL_WORDS), self.poem_sampler.n_paths)
+
+        if self.args.profile_startup:
+            LOG.info('startup profile:\n%s', self.profile.report())
+
+    async def co_measure_loop_lag(self):
+        ''' Measure how much later than asked for the event loop wakes us up
+        '''
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(LOOP_LAG_SECONDS)
+            _LOOP_LAG.observe(max(0, self.loop.time() - start - LOOP_LAG_SECONDS))
+
+    def show_last_frame(self):
+        ''' Show the clock face saved by the last run, if there is one
+        '''
+        try:
+            with open(LAST_FRAME_FILE, 'rb') as fil:
+                frame = fil.read()
+
+        except OSError:
+            return
+
+        if len(frame) == len(self.pixels.copy()):
+            self.pixels.load(frame)
+            self.compositor.submit(LAYER_CLOCK)
+            self.compositor.render_frame()
+
+    def save_last_frame(self):
+        ''' Save the clock face, if it's showing
+        '''
+        self.last_frame_save_time = time.monotonic()
+
+        if self.compositor.top() != LAYER_CLOCK:
+            return
+
+        try:
+            tmp_file = LAST_FRAME_FILE + '.tmp'
+
+            with open(tmp_file, 'wb') as fil:
+                fil.write(self.compositor.layers[LAYER_CLOCK].copy())
+
+            os.replace(tmp_file, LAST_FRAME_FILE)
+
+        except OSError as err:
+            LOG.error('Failed to save the last frame: %s', err)
 
     def read_params(self):
         ''' Read our parameters
@@ -664,11 +890,10 @@ class Main():
             self.read_params_file(WIFI_PARAMS_FILE)
 
             self.set_timezone()
-            self.print_debug(self.params)
+            LOG.debug('params %s', self.params)
 
-        except Exception as err: #pylint: disable=broad-except
-            print('Error reading params:', str(err), flush=True)
-            traceback.print_exc()
+        except Exception: #pylint: disable=broad-except
+            LOG.exception('Error reading params')
 
     def read_params_file(self, path):
         ''' Read a params file
@@ -690,9 +915,19 @@ class Main():
     async def run_http_server(self):
         ''' Run our web server.
         '''
-        app = web.Application()
+        @web.middleware
+        async def _time_request(request, handler):
+            resource = request.match_info.route.resource
+            histogram = metrics.REGISTRY.histogram(
+                'wordclock_http_request_seconds',
+                route=resource.canonical if resource is not None else 'unmatched')
+
+            with histogram.time():
+                return await handler(request)
+
+        app = web.Application(middlewares=[_time_request])
         app.add_routes([
-            web.static('/static', '/var/wordclock/website/static'),
+            web.get('/static/{name}', self.handle_get_static),
             web.get('/', self.handle_get_body),
             web.get('/vars.js', self.handle_get_vars),
             web.post('/save', self.handle_post_save),
@@ -700,24 +935,37 @@ class Main():
             web.get('/state', self.handle_get_state),
             web.post('/futz', self.handle_post_futz),
             web.get('/ping', self.handle_get_ping),
+            web.get('/metrics', self.handle_get_metrics),
+            web.get('/logs', self.handle_get_logs),
             ])
 
+        await self.loop.run_in_executor(None, self.web_assets.load)
+
         self.http_runner = web.AppRunner(app)
         await self.http_runner.setup()
-        site = web.TCPSite(self.http_runner, host=None, port=PORT_HTTP)
+        site = web.TCPSite(self.http_runner, host=None, port=self.args.port)
         await site.start()
 
-    async def handle_get_body(self, _request):
+    async def handle_get_body(self, request):
         ''' handle web get main body
         '''
-        self.print_debug('send body')
+        LOG.debug('send body')
+        asset = self.web_assets.body()
 
-        with open(BODY_FILE, 'r') as fil:
-            body = fil.read()
+        if asset is None:
+            raise web.HTTPNotFound()
 
-        return web.Response(
-            text=body.format(title=SETTINGS_TITLE),
-            content_type='text/html')
+        return assets.respond(request, asset, assets.NO_CACHE)
+
+    async def handle_get_static(self, request):
+        ''' handle web get static file
+        '''
+        asset = self.web_assets.static(request.match_info['name'])
+
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        return assets.respond(request, asset, assets.static_cache_control(request, asset))
 
     async def handle_get_vars(self, _request):
         ''' handle web get javascript vars
@@ -745,7 +993,7 @@ class Main():
                 version=__version__,
             ))
 
-        self.print_debug('send vars:\n{}'.format(js_vars))
+        LOG.debug('send vars:\n%s', js_vars)
 
         return web.Response(content_type='text/javascript', text=js_vars)
 
@@ -755,7 +1003,7 @@ class Main():
         data = await get_request_data(request)
 
         if data:
-            self.print_debug('save:', data)
+            LOG.debug('save: %s', data)
             return self.do_config_save(data)
 
         raise web.HTTPBadRequest()
@@ -766,13 +1014,14 @@ class Main():
         data = await get_request_data(request)
 
         if data:
-            self.print_debug('mode:', data)
+            LOG.debug('mode: %s', data)
             new_mode = DisplayMode[data.get('display_mode')]
 
             if self.display_mode != new_mode:
                 self.is_on = True
                 self.set_display_mode(new_mode)
                 self.update_clock()
+                self.scheduler.wake(JOB_STATUS)
 
         return  web.json_response(dict())
 
@@ -787,7 +1036,7 @@ class Main():
             display_mode=self.display_mode.name,
             sunrise_orientation=self.get_compass_sunrise())
 
-        self.print_debug('state:', state)
+        LOG.debug('state: %s', state)
 
         return web.json_response(state)
 
@@ -797,10 +1046,11 @@ class Main():
         data = await get_request_data(request)
 
         if bool(data):
-            self.print_debug('futz:', data)
+            LOG.debug('futz: %s', data)
 
             self.futzing = True
             self.last_ping = time.time()
+            self.scheduler.wake(JOB_STATUS)
             self.brightness_factor = max(0, min(100, data.get('brightness', 100))) / 100
 
             self.write_clock(
@@ -817,11 +1067,27 @@ class Main():
         ''' handle web ajax get ping request (to keep futz mode alive)
         '''
         self.last_ping = time.time()
-        self.print_debug('ping', self.futzing, self.last_ping)
+        LOG.debug('ping %s %s', self.futzing, self.last_ping)
 
         # Tell the browser to stop, except on the very first ping
         return web.json_response(dict(ok=self.futzing or self.last_ping is None))
 
+    async def handle_get_metrics(self, _request):
+        ''' handle web get metrics, in the Prometheus text format
+        '''
+        return web.Response(text=metrics.REGISTRY.text(), content_type='text/plain')
+
+    async def handle_get_logs(self, request):
+        ''' handle web get recent log records, e.g. /logs?level=WARNING&limit=50
+        '''
+        level = logging.getLevelName(request.query.get('level', 'DEBUG').upper())
+        limit = request.query.get('limit', '')
+
+        if not isinstance(level, int) or limit and not limit.isdigit():
+            raise web.HTTPBadRequest(text='level must be a log level and limit a number')
+
+        return web.json_response(logs.RECENT.records(level, int(limit) if limit else None))
+
     def stop_futzing(self):
         ''' stop futzing with brightness
         '''
@@ -871,50 +1137,44 @@ class Main():
                 self.configure_wifi(new_ssid, new_password)
 
             elif running_hotspot:
-                if not self.args.daemon:
-                    print('hotspot -> starting wifi', flush=True)
+                LOG.info('hotspot -> starting wifi')
                 self.loop.create_task(self.co_start_wifi())
 
             if changed_latlon:
                 self.set_timezone()
+                self.compass.invalidate_declination()
 
             self.set_brightness_factor()
             self.set_sunrise_orientation()
             self.update_clock()
 
         except Exception as err: #pylint: disable=broad-except
-            traceback.print_exc()
+            LOG.exception('Error saving the settings')
             response = dict(ok=False, wifi_changed=False, msg='Error: {}'.format(err))
 
         return web.Response(text=json.dumps(response), content_type='text/json')
 
-    async def manage_button(self):
-        ''' Monitor button presses
+    def handle_gesture(self, gesture):
+        ''' Handle a completed button gesture
         '''
-        while True:
-            if (not self.button_down_time and self.button_presses and
-                    time.time() - self.button_up_time > 1):
+        LOG.debug('button gesture %s', gesture)
 
-                self.print_debug('button presses', self.button_presses)
+        if gesture in [button.Gesture.PRESS, button.Gesture.LONG_PRESS]:
+            self.do_button_press_1(gesture == button.Gesture.LONG_PRESS)
+        else:
+            self.is_on = True
 
-                if self.button_presses == 1:
-                    self.do_button_press_1()
-                else:
-                    self.is_on = True
-
-                    if self.button_presses == 2:
-                        self.set_display_mode(DisplayMode.RANDOM_WORDS)
-                    elif self.button_presses == 3:
-                        self.set_display_mode(DisplayMode.DEMO)
-                    elif self.button_presses == 4:
-                        self.set_display_mode(DisplayMode.DEMO_BIRTHDAY)
-
-                self.button_presses = 0
-                self.do_birthday = False
-                self.do_poem = False
-                self.update_clock()
+            if gesture == button.Gesture.DOUBLE_PRESS:
+                self.set_display_mode(DisplayMode.RANDOM_WORDS)
+            elif gesture == button.Gesture.TRIPLE_PRESS:
+                self.set_display_mode(DisplayMode.DEMO)
+            elif gesture == button.Gesture.QUAD_PRESS:
+                self.set_display_mode(DisplayMode.DEMO_BIRTHDAY)
 
-            await asyncio.sleep(0.1)
+        self.do_birthday = False
+        self.do_poem = False
+        self.update_clock()
+        self.scheduler.wake(JOB_STATUS)
 
     def set_display_mode(self, mode):
         ''' Set the display mode
@@ -922,17 +1182,17 @@ class Main():
         self.display_mode = mode
 
         if mode == DisplayMode.RANDOM_WORDS:
-            self.loop.create_task(self.display_random())
+            self.scheduler.add(JOB_MODE, self.display_random())
         elif mode == DisplayMode.DEMO:
-            self.loop.create_task(self.display_demo())
+            self.scheduler.add(JOB_MODE, self.display_demo())
         elif mode == DisplayMode.DEMO_BIRTHDAY:
-            self.loop.create_task(self.display_birthday_demo())
+            self.scheduler.add(JOB_MODE, self.display_birthday_demo())
 
-    def do_button_press_1(self):
+    def do_button_press_1(self, is_long):
         ''' Handle a single button press
         '''
-        if self.button_duration >= LONG_PRESS_DURATION:
-            self.print_debug('long press')
+        if is_long:
+            LOG.debug('long press')
             self.display_mode = DisplayMode.CLOCK
             self.start_hotspot_event.set()
         else:
@@ -944,8 +1204,7 @@ class Main():
                     self.display_mode = DisplayMode.CLOCK
                 else:
                     self.is_on = False
-                    self.pixels.fill(COLOR_OFF)
-                    self.pixels.show()
+                    self.compositor.clear()
             else:
                 self.is_on = True
 
@@ -957,8 +1216,10 @@ class Main():
         while True:
             if self.state in [State.WIFI_INIT, State.WIFI_ACTIVE]:
 
-                self.print_debug('checking wifi', self.state)
-                self.server_ip = await self.loop.run_in_executor(None, check_wifi, self.args.debug)
+                LOG.debug('checking wifi %s', self.state)
+                with _WIFI_CHECK_TIME.time():
+                    self.server_ip = await self.loop.run_in_executor(
+                        None, self.hardware.check_wifi, self.args.debug)
 
                 if self.server_ip:
                     new_state = State.WIFI_ACTIVE
@@ -968,10 +1229,7 @@ class Main():
                     if self.state == State.WIFI_ACTIVE:
                         n_failures += 1
 
-                        if not self.args.daemon:
-                            print(
-                                str(datetime.datetime.now()),
-                                'wifi failures:', n_failures, flush=True)
+                        LOG.warning('wifi failures: %d', n_failures)
 
                         if n_failures == 6:
                             new_state = State.WIFI_INIT
@@ -979,14 +1237,10 @@ class Main():
                         else:
                             new_state = self.state
                     else:
-                        if not self.args.daemon:
-                            print(str(datetime.datetime.now()), 'wifi still down', flush=True)
+                        LOG.warning('wifi still down')
 
                 if self.state != new_state:
-                    if not self.args.daemon:
-                        print(
-                            str(datetime.datetime.now()),
-                            'wifi -> {}'.format(new_state), flush=True)
+                    LOG.info('wifi -> %s', new_state)
                     self.state = new_state
                     self.update_clock()
             else:
@@ -994,38 +1248,28 @@ class Main():
 
             await asyncio.sleep(10)
 
-    async def display_status(self):
+    def display_status(self):
         ''' Display status lights when not running the clock.
-            Also monitor ambient light and compass
+            Also stop futzing when the web page stops pinging.
+            This only ticks while there is something to show; otherwise it waits to be woken.
         '''
-        light_history = deque()
-
         while True:
             now = time.time()
-            now_quarter_second = round(now * 4) / 4
-            at_second = now_quarter_second % 1 == 0
-
-            if at_second:
-                if self.update_ambient(light_history) and not self.futzing:
-                    self.update_clock()
 
-                if self.futzing and self.last_ping and now - self.last_ping > 5:
-                    self.stop_futzing()
+            if self.futzing and self.last_ping and now - self.last_ping >= FUTZ_TIMEOUT:
+                self.stop_futzing()
 
-            if (self.button_down_time or self.button_presses or
-                    self.is_on and self.state != State.WIFI_ACTIVE):
+            if self.button.active or self.is_on and self.state != State.WIFI_ACTIVE:
+                now_quarter_second = round(now * 4) / 4
+                at_second = now_quarter_second % 1 == 0
 
-                self.pixels.fill(COLOR_OFF)
+                self.begin_layer(LAYER_STATUS)
 
-                if self.button_down_time and self.button_presses == 0:
-                    is_long = now - self.button_down_time >= LONG_PRESS_DURATION
-                elif not self.button_down_time and self.button_presses == 1:
-                    is_long = self.button_duration >= LONG_PRESS_DURATION
-                else:
-                    is_long = False
+                is_long = self.button.is_long(now)
 
-                if self.button_down_time or self.button_presses:
-                    for i in range(self.button_presses + (1 if self.button_down_time else 0)):
+                if self.button.active:
+                    for i in range(
+                            self.button.presses + (0 if self.button.down_time is None else 1)):
                         self.set_numeric_pixel(
                             i+1,
                             COLOR_LONG_BUTTON_PRESS if is_long else COLOR_BUTTON_PRESS)
@@ -1036,32 +1280,42 @@ class Main():
                         state_display = STATE_DISPLAY[self.state]
                         self.set_numeric_pixel(state_display.index, state_display.color)
 
-                self.pixels.show()
-
-            await asyncio.sleep(now_quarter_second + 0.25 - now)
-
-    async def update_compass(self):
-        ''' Update the compass
-        '''
-        while True:
-            self.orientation = await self.loop.run_in_executor(None, self.do_update_compass)
+                self.compositor.submit(LAYER_STATUS)
+                yield now_quarter_second + 0.25 - now
 
-            # This is to prevent is from jittering between left and right sunrises.
-            if (self.orientation.angle is not None and
-                    abs(self.cur_angle - self.orientation.angle) > COMPASS_JITTER_THRESHOLD):
-                self.cur_angle = self.orientation.angle
+            else:
+                self.compositor.withdraw(LAYER_STATUS)
 
-            self.set_sunrise_orientation()
-            await asyncio.sleep(2)
+                if self.futzing and self.last_ping:
+                    yield self.last_ping + FUTZ_TIMEOUT - now
+                else:
+                    yield None
 
-    def do_update_compass(self):
-        ''' Update the compass
+    def read_compass(self, mag_coords):
+        ''' Return the orientation for a magnetometer reading. This runs on the
+            sensor hub's thread, because the heading filter, the declination model
+            and saving the calibration are too slow for the event loop.
         '''
         return self.compass.update(
+            self.sensors.latest(sensorhub.ACCELEROMETER),
+            mag_coords,
+            do_calibration=DO_CALIBRATION,
             verbose=self.args.debug,
             lat=self.params.get(PARAM_LAT),
             lon=self.params.get(PARAM_LON))
 
+    def handle_compass(self, orientation):
+        ''' Update the compass orientation (called by the sensor hub)
+        '''
+        self.orientation = orientation
+
+        # This is to prevent is from jittering between left and right sunrises.
+        if (self.orientation.angle is not None and
+                abs(self.cur_angle - self.orientation.angle) > COMPASS_JITTER_THRESHOLD):
+            self.cur_angle = self.orientation.angle
+
+        self.set_sunrise_orientation()
+
     def set_sunrise_orientation(self):
         ''' Set the sunrise orientation
         '''
@@ -1078,13 +1332,21 @@ class Main():
             if self.cur_angle > 270 or self.cur_angle <= 90
             else SUNRISE_RIGHT)
 
-    async def display_clock(self):
-        ''' Update the clock
+    def display_clock(self):
+        ''' Update the clock at the start of each minute
         '''
+        sleep = self.update_clock()
+        self.profile.mark('clock started')
+
         while True:
-            await asyncio.sleep(self.update_clock())
+            yield sleep
+
+            sleep = self.update_clock()
 
-    async def display_demo(self):
+            if time.monotonic() - self.last_frame_save_time >= LAST_FRAME_SAVE_SECONDS:
+                self.save_last_frame()
+
+    def display_demo(self):
         ''' Update the clock in demo mode
         '''
         state = "sunrise"
@@ -1102,8 +1364,7 @@ class Main():
             SS_END: self.round_up_5(sunset_times.blue_end, 9),
             }
 
-        if not self.args.daemon:
-            print(baseline)
+        LOG.debug('demo baseline %s', baseline)
 
         cur = baseline
         demo_now = cur[SR_BEGIN]
@@ -1166,16 +1427,15 @@ class Main():
             sleep = 0.1
             do_switch[state]()
 
-            if not self.args.daemon:
-                print(state, demo_now, sleep)
+            LOG.debug('demo %s %s %s', state, demo_now, sleep)
 
             if self.should_run(DisplayMode.DEMO):
                 self.write_clock(demo_now)
 
             demo_now = demo_now + datetime.timedelta(minutes=1)
-            await asyncio.sleep(sleep)
+            yield sleep
 
-    async def display_random(self):
+    def display_random(self):
         ''' Update random words
         '''
         random_indeces = list(range(len(configdefs.ALL_WORDS)))
@@ -1186,16 +1446,18 @@ class Main():
         while self.display_mode == DisplayMode.RANDOM_WORDS:
             if self.should_run(DisplayMode.RANDOM_WORDS):
 
-                self.pixels.fill(COLOR_OFF)
+                self.begin_layer(LAYER_POEM)
                 self.set_word_border()
 
                 if word_index == 0:
                     color = random.choice(RANDOM_COLORS)
                     word = configdefs.ALL_WORDS[random_indeces[random_index]]
                     random_index = (random_index + 1) % len(random_indeces)
-                    poem = random.choice(word.poems) if DO_RANDOM_WORD_POEMS and word.poems else []
+                    poem = (
+                        self.poem_sampler.sample(word)
+                        if DO_RANDOM_WORD_POEMS and self.poem_sampler else None) or []
 
-                    self.print_debug(word)
+                    LOG.debug('random word %s', word)
 
                     self.set_word(word, color=color)
                     sleep_time = RANDOM_WORD_PAUSE
@@ -1207,54 +1469,44 @@ class Main():
                     sleep_time = (
                         RANDOM_WORD_PAUSE if word_index == len(poem) - 1 else POEM_WORD_PAUSE)
 
-                self.pixels.show()
+                self.compositor.submit(LAYER_POEM)
                 word_index = (word_index + 1) % (len(poem) + 1)
 
             else:
                 sleep_time = 0.1
 
-            await asyncio.sleep(sleep_time)
+            yield sleep_time
 
-    async def display_birthday_demo(self):
+    def display_birthday_demo(self):
         ''' Update the clock in demo mode
         '''
         self.do_birthday = True
-        self.loop.create_task(self.display_birthday())
+        self.scheduler.add(JOB_BIRTHDAY, self.display_birthday())
 
         birthday_names = list(config.BIRTHDAYS.values())
         index = 0
 
-        while self.display_mode == DisplayMode.DEMO_BIRTHDAY:
-            if self.should_run(DisplayMode.DEMO_BIRTHDAY):
-                self.birthday_name = birthday_names[index]
-                index = (index + 1) % len(birthday_names)
+        # The scheduler closes the job when the mode changes, so clean up in finally
+        try:
+            while self.display_mode == DisplayMode.DEMO_BIRTHDAY:
+                if self.should_run(DisplayMode.DEMO_BIRTHDAY):
+                    self.birthday_name = birthday_names[index]
+                    index = (index + 1) % len(birthday_names)
 
-            await asyncio.sleep(2)
+                yield 2
 
-        self.do_birthday = False
+        finally:
+            self.do_birthday = False
 
-    def update_ambient(self, light_history):
-        ''' Update ambient light settings
+    def handle_light(self, light):
+        ''' Update ambient light settings from a light sensor reading (called by the sensor hub)
         '''
-        self.init_light_sensor()
-
-        if self.light_sensor is not None:
-            try:
-                light_history.append(self.light_sensor.light)
-            except Exception as err: #pylint: disable=broad-except
-                self.light_sensor = None
-                print('Exception reading light sensor: {}'.format(err), flush=True)
+        self.light_history.append(light)
+        self.cur_ambient = round(sum(self.light_history) / len(self.light_history))
 
-        if self.light_sensor is None:
-            changed = False
-        else:
-            if len(light_history) > AMBIENT_SMOOTHING_DEQUE_LEN:
-                light_history.popleft()
-
-            self.cur_ambient = round(sum(light_history) / len(light_history))
-            changed = self.set_brightness_factor()
-
-        return changed
+        # Small changes wait for the next frame, so the light doesn't keep the strip busy
+        if self.set_brightness_factor() and not self.futzing:
+            self.compositor.refresh()
 
     def set_brightness_factor(self):
         ''' Set the current brightness
@@ -1274,18 +1526,11 @@ class Main():
         self.brightness_factor = (
             (min_brightness + light_factor * (max_brightness - min_brightness)) / 100)
 
-        if self.args.debug:
-            print(
-                'min lt', min_light,
-                'max lt', max_light,
-                'min br', min_brightness,
-                'max br', max_brightness)
-            print(
-                'amb', round(self.cur_ambient, 2),
-                'bound', round(bounded_light, 2),
-                'lightfactor', round(light_factor, 2),
-                'brightfactor', round(self.brightness_factor, 2),
-                flush=True)
+        LOG.debug(
+            'min lt %s max lt %s min br %s max br %s amb %.2f bound %.2f '
+            'lightfactor %.2f brightfactor %.2f',
+            min_light, max_light, min_brightness, max_brightness,
+            self.cur_ambient, bounded_light, light_factor, self.brightness_factor)
 
         return abs(cur_factor - self.brightness_factor) > 0.05
 
@@ -1295,7 +1540,7 @@ class Main():
         now = datetime.datetime.now(self.timezone)
         now_minute = now.replace(second=0, microsecond=0)
 
-        self.print_debug('clock', now, now_minute)
+        LOG.debug('clock %s %s', now, now_minute)
 
         if self.should_run(DisplayMode.CLOCK):
             self.write_clock(now_minute)
@@ -1317,7 +1562,7 @@ class Main():
 
                 if not self.do_birthday:
                     self.do_birthday = True
-                    self.loop.create_task(self.display_birthday())
+                    self.scheduler.add(JOB_BIRTHDAY, self.display_birthday())
 
             else:
                 poem_mode = self.params[PARAM_POEMS]
@@ -1330,18 +1575,34 @@ class Main():
 
                     if not self.do_poem:
                         self.do_poem = True
-                        self.loop.create_task(self.display_poem())
+                        self.scheduler.add(JOB_POEM, self.display_poem())
 
         if do_clock:
             self.do_birthday = False
             self.do_poem = False
+            self.compositor.withdraw(LAYER_POEM)
+            self.compositor.withdraw(LAYER_MARQUEE)
 
-            self.pixels.fill(COLOR_OFF)
-            self.write_time(now_minute)
+            self.begin_layer(LAYER_CLOCK)
+            self.pixels.load(self.get_time_frame(now_minute))
             self.write_minute(now_minute)
             self.write_weekday(now_minute)
             self.write_sun(now_minute)
-            self.pixels.show()
+            self.compositor.submit(LAYER_CLOCK)
+
+    def get_time_frame(self, now_minute):
+        ''' Return a frame containing just the time sentence.
+            There are only 144 different sentences, so the frames are cached.
+        '''
+        key = (now_minute.hour % len(HOURS), now_minute.minute // 5)
+        frame = self.time_frames.get(key)
+
+        if frame is None:
+            self.pixels.fill(COLOR_OFF)
+            self.write_time(now_minute)
+            frame = self.time_frames[key] = self.pixels.copy()
+
+        return frame
 
     def write_time(self, now_minute):
         ''' Write the time sentence
@@ -1394,69 +1655,74 @@ class Main():
         '''
         sun_params = self.astral_info.get_sun(now_minute.timestamp(), self.sunrise)
 
-        for i in ASTRAL_PIXELS_RANGE:
-            self.set_pixel(i, sun_params.sky_color)
-
-        for i in GROUND_PIXELS_RANGE:
-            self.set_pixel(i, sun_params.ground_color)
+        self.set_pixels(ASTRAL_PIXELS_RUNS, sun_params.sky_color)
+        self.set_pixels(GROUND_PIXELS_RUNS, sun_params.ground_color)
 
         if sun_params.sun_pixel:
             self.set_pixel(sun_params.sun_pixel, sun_params.sun_color)
 
-    async def display_birthday(self):
+    def display_birthday(self):
         ''' Display the birthday message
         '''
         offset = 0
 
-        while self.do_birthday:
-            if not self.button_presses:
-                self.pixels.fill(COLOR_OFF)
+        try:
+            while self.do_birthday:
+                if not self.button.presses:
+                    self.begin_layer(LAYER_MARQUEE)
+
+                    self.set_word(config.HAPPY)
+                    self.set_word(config.BIRTHDAY)
+                    self.set_word(self.birthday_name)
 
-                self.set_word(config.HAPPY)
-                self.set_word(config.BIRTHDAY)
-                self.set_word(self.birthday_name)
+                    for i in range(
+                            BORDER_PIXELS_BASE + MARQEE_LIGHT_DELTA - offset - 1,
+                            BORDER_PIXELS_BASE + BORDER_PIXELS_LEN,
+                            MARQEE_LIGHT_DELTA):
+                        self.set_pixel(i, COLOR_BORDER_LIGHT1)
 
-                for i in range(
-                        BORDER_PIXELS_BASE + MARQEE_LIGHT_DELTA - offset - 1,
-                        BORDER_PIXELS_BASE + BORDER_PIXELS_LEN,
-                        MARQEE_LIGHT_DELTA):
-                    self.set_pixel(i, COLOR_BORDER_LIGHT1)
+                    for i in range(
+                            offset,
+                            len(MARQEE_PIXELS),
+                            MARQEE_LIGHT_DELTA):
+                        self.set_pixel(MARQEE_PIXELS[i], COLOR_BORDER_LIGHT2)
 
-                for i in range(
-                        offset,
-                        len(MARQEE_PIXELS),
-                        MARQEE_LIGHT_DELTA):
-                    self.set_pixel(MARQEE_PIXELS[i], COLOR_BORDER_LIGHT2)
+                    self.compositor.submit(LAYER_MARQUEE)
+                    offset = (offset + 1) % MARQEE_LIGHT_DELTA
 
-                self.pixels.show()
-                offset = (offset + 1) % MARQEE_LIGHT_DELTA
+                yield 0.1
 
-            await asyncio.sleep(0.1)
+        finally:
+            self.compositor.withdraw(LAYER_MARQUEE)
 
-    def get_next_poem_indeces(self):
+    def get_next_poem_lines(self):
         ''' Return the lines of the next pome
         '''
-        return [self.get_next_poem_index() for _ in range(N_POEM_LINES)]
+        if self.poem_sampler is None:
+            return [()] * N_POEM_LINES
 
-    async def display_poem(self):
+        return [self.poem_sampler.sample() or () for _ in range(N_POEM_LINES)]
+
+    def display_poem(self):
         ''' Display a poem
         '''
-        indeces = self.get_next_poem_indeces()
+        lines = self.get_next_poem_lines()
         cur_line = 0
         cur_word = 0
         color = random.choice(RANDOM_COLORS)
         poem_start = time.time()
+        log_level = logging.INFO if self.args.test_poems else logging.DEBUG
 
         while self.do_poem:
-            if not self.button_presses:
-                self.pixels.fill(COLOR_OFF)
+            if not self.button.presses:
+                self.begin_layer(LAYER_POEM)
                 self.set_word_border()
 
                 if cur_line != N_POEM_LINES:
-                    for word in ALL_POEMS[indeces[cur_line]][:cur_word+1]:
+                    for word in lines[cur_line][:cur_word+1]:
                         self.set_word(word, color=color)
 
-                self.pixels.show()
+                self.compositor.submit(LAYER_POEM)
 
                 cur_word += 1
 
@@ -1464,12 +1730,11 @@ class Main():
                     cur_line += 1
 
                     if cur_line == N_POEM_LINES:
-                        self.print_debug(
-                            'end', time.time() - poem_start, force=self.args.test_poems)
+                        LOG.log(log_level, 'end %.2f', time.time() - poem_start)
                         sleep_time = POEM_END_PAUSE
 
                         if self.args.test_poems:
-                            indeces = self.get_next_poem_indeces()
+                            lines = self.get_next_poem_lines()
 
                     else:
                         cur_word = 0
@@ -1478,22 +1743,19 @@ class Main():
                             cur_line = 0
                             now = time.time()
                             sleep_time = max(0, poem_start + POEM_DURATION - now)
-                            self.print_debug(
-                                'inter', now - poem_start, sleep_time, force=self.args.test_poems)
+                            LOG.log(log_level, 'inter %.2f %.2f', now - poem_start, sleep_time)
                             poem_start = now + sleep_time
                         else:
-                            self.print_debug(
-                                'line', time.time() - poem_start, force=self.args.test_poems)
+                            LOG.log(log_level, 'line %.2f', time.time() - poem_start)
                             sleep_time = POEM_LINE_PAUSE
                 else:
-                    self.print_debug(
-                        'word', time.time() - poem_start, force=self.args.test_poems)
+                    LOG.log(log_level, 'word %.2f', time.time() - poem_start)
                     sleep_time = POEM_WORD_PAUSE
 
             else:
                 sleep_time = 0.1
 
-            await asyncio.sleep(sleep_time)
+            yield sleep_time
 
     def set_day(self, now_minute):
         ''' bump the day
@@ -1503,6 +1765,7 @@ class Main():
         if today != self.today:
             self.today = today
             self.astral_info.set_day(today)
+            self.check_sun_calendar()
 
         # Always set the birthday_name, because the birthday demo mode overwrites it
         #
@@ -1516,21 +1779,12 @@ class Main():
     def set_word(self, word, color=None):
         ''' Set a word pixels
         '''
-        if color is None:
-            color = COLOR_WORD
-
-        if word.vertical:
-            for y_i in range(word.y, word.y + len(word.text)):
-                self.set_pixel(PIXEL_MAP[word.x][y_i], color)
-        else:
-            for x_i in range(word.x, word.x + len(word.text)):
-                self.set_pixel(PIXEL_MAP[x_i][word.y], color)
+        self.set_pixels(word.runs, COLOR_WORD if color is None else color)
 
     def set_word_border(self):
         ''' Set the border pixels for displaying words and poems
         '''
-        for i in range(BORDER_PIXELS_BASE, BORDER_PIXELS_END):
-            self.set_pixel(i, COLOR_RANDOM_BORDER)
+        self.set_pixels(BORDER_PIXELS_RUNS, COLOR_RANDOM_BORDER)
 
     def set_numeric_pixel(self, index, color):
         ''' Set a numeric pixel
@@ -1542,40 +1796,36 @@ class Main():
         '''
         self.set_pixel(PIXEL_MAP[index_x][index_y], color, full)
 
+    def begin_layer(self, layer):
+        ''' Clear a layer and make it the one that the drawing methods draw into.
+            Submit it to the compositor when it is drawn.
+        '''
+        self.pixels = self.compositor.layers[layer]
+        self.pixels.fill(COLOR_OFF)
+
     def set_pixel(self, index, color, full=False):
         ''' Set a pixel
         '''
-        self.pixels[index] = (
-            color if full or self.brightness_factor == 1
-            else (
-                round(color[0] * self.brightness_factor),
-                round(color[1] * self.brightness_factor),
-                round(color[2] * self.brightness_factor)))
+        if full:
+            self.pixels.set_full(index, color)
+        else:
+            self.pixels[index] = color
+
+    def set_pixels(self, runs, color):
+        ''' Set runs of pixels (see framebuffer.pixel_runs) to the same color
+        '''
+        self.pixels.set_runs(runs, color)
 
     def handle_button(self, _channel):
         ''' Handle button events. This function runs in a separate thread.
         '''
-        asyncio.run_coroutine_threadsafe(self.co_handle_button(), self.loop)
+        self.loop.call_soon_threadsafe(self.handle_button_edge, time.time())
 
-    async def co_handle_button(self):
-        ''' Handle button events in a coroutine
+    def handle_button_edge(self, now):
+        ''' Feed a button edge to the gesture recognizer
         '''
         self.stop_futzing()
-        now = time.time()
-        await asyncio.sleep(0.050)
-
-        if GPIO.input(PIN_BUTTON): #pylint: disable=no-member
-            self.button_up_time = now
-            self.button_duration = now - self.button_down_time if self.button_down_time else 0
-            self.button_down_time = None
-
-            if self.button_presses < 4:
-                self.button_presses += 1
-
-            self.print_debug('up', self.button_presses, now, self.button_duration)
-        else:
-            self.button_down_time = now
-            self.print_debug('down', self.button_down_time)
+        self.button.edge(now)
 
     async def handle_start_hotspot_event(self):
         ''' Start the hotspot in a background thread
@@ -1587,7 +1837,8 @@ class Main():
             if not self.state == State.HOTSPOT:
                 self.state = State.HOTSPOT
 
-                if not await self.loop.run_in_executor(None, start_hotspot, not self.args.daemon):
+                if not await self.loop.run_in_executor(
+                        None, self.hardware.start_hotspot, not self.args.daemon):
                     self.state = State.ERROR
 
     def configure_wifi(self, ssid, password):
@@ -1595,20 +1846,9 @@ class Main():
             If the holmdell network is configured, preserve it.
             Replace any other network definitions with the new ssid and password.
         '''
-        if not self.args.daemon:
-            print('new wifi settings', ssid, password, flush=True)
-
-        with open(WPA_SUPPLICANT_CONF_FILE, 'r') as fil:
-            wpa = WpaSupplicantConf(fil)
-
-        for network in [ssid for ssid in wpa.networks() if ssid != HOLMDELL_SSID]:
-            wpa.remove_network(network)
-
-        wpa.add_network(ssid, psk=f'"{password}"', key_mgmt='WPA-PSK')
-
-        with open(WPA_SUPPLICANT_CONF_FILE, 'w') as fil:
-            wpa.write(fil)
+        LOG.info('new wifi settings %s', ssid)
 
+        self.hardware.write_wifi_config(ssid, password, HOLMDELL_SSID)
         self.loop.create_task(self.co_start_wifi())
 
     async def co_start_wifi(self):
@@ -1617,29 +1857,110 @@ class Main():
         old_state = self.state
         self.state = State.WIFI_INIT
         await asyncio.sleep(2)
-        self.loop.run_in_executor(None, start_wifi, old_state)
+        self.loop.run_in_executor(None, self.hardware.start_wifi, old_state == State.HOTSPOT)
 
     def set_timezone(self):
-        ''' Set the timezone, based on lat/lon
+        ''' Set the timezone, based on lat/lon.
+            If the timezone for lat/lon isn't cached, use UTC until it is found.
         '''
-        self.timezone = pytz.utc
+        lat = self.params.get(PARAM_LAT)
+        lon = self.params.get(PARAM_LON)
         tz_name = None
+        self.pending_timezone = None
 
+        if lat and lon:
+            tz_name = self.timezones.get_cached(lat, lon)
+
+            if tz_name is None:
+                self.pending_timezone = (lat, lon)
+                self.loop.create_task(self.co_set_timezone(lat, lon))
+
+        self.apply_timezone(lat, lon, tz_name)
+
+    async def co_set_timezone(self, lat, lon):
+        ''' Find the timezone for lat/lon in the background, and then apply it
+        '''
         try:
-            lat = self.params.get(PARAM_LAT)
-            lon = self.params.get(PARAM_LON)
+            tz_name = await self.timezones.lookup(lat, lon)
+
+        except Exception as err: #pylint: disable=broad-except
+            LOG.warning('Exception finding timezone: %s', err)
+            tz_name = None
+
+        if self.pending_timezone != (lat, lon):
+            # The location changed while we were looking
+            return
+
+        self.pending_timezone = None
 
+        if tz_name:
+            self.apply_timezone(lat, lon, tz_name)
+        else:
+            # Stay on UTC, and give it a sun calendar
+            self.check_sun_calendar()
+
+        self.update_clock()
+
+    def apply_timezone(self, lat, lon, tz_name):
+        ''' Set the timezone and the astral info for lat/lon
+        '''
+        self.timezone = pytz.utc
+
+        try:
             if lat and lon:
-                tz_name = TimezoneFinder().timezone_at(lat=lat, lng=lon)
-                self.timezone = pytz.timezone(tz_name)
-                self.astral_info = AstralInfo(lat, lon, self.timezone, not self.args.daemon)
+                calendar = None
+
+                if tz_name:
+                    self.timezone = pytz.timezone(tz_name)
+                    calendar = suncalendar.load(
+                        lat, lon, self.timezone, datetime.datetime.now(self.timezone).date())
+
+                self.astral_info = AstralInfo(
+                    lat, lon, self.timezone, not self.args.daemon, calendar=calendar)
+
+                if tz_name:
+                    self.check_sun_calendar()
+
+        except Exception: #pylint: disable=broad-except
+            LOG.exception('Exception setting timezone')
+
+        LOG.info('location %s %s timezone %s (%s)', lat, lon, tz_name, self.timezone)
+
+    def check_sun_calendar(self):
+        ''' Start building a new sun calendar if the current one is missing or
+            doesn't cover the coming days. Wait for a pending timezone lookup,
+            rather than build a calendar for UTC that is about to be replaced.
+        '''
+        astral_info = self.astral_info
+        today = datetime.datetime.now(self.timezone).date()
+
+        if (astral_info is None or self.building_sun_calendar or self.pending_timezone or
+                astral_info.calendar and astral_info.calendar.matches(
+                    astral_info.lat, astral_info.lon, astral_info.timezone, today)):
+            return
+
+        self.building_sun_calendar = True
+        self.loop.create_task(self.co_build_sun_calendar(astral_info, today))
+
+    async def co_build_sun_calendar(self, astral_info, today):
+        ''' Build the sun calendar in the background
+        '''
+        try:
+            calendar = await self.loop.run_in_executor(
+                None, suncalendar.build,
+                astral_info.lat, astral_info.lon, astral_info.timezone, today)
+
+            astral_info.calendar = calendar
+            LOG.debug('built sun calendar %s %s', astral_info.lat, astral_info.lon)
 
         except Exception as err: #pylint: disable=broad-except
-            print('Exception setting timezone: {}'.format(err))
-            traceback.print_exc()
+            LOG.error('Exception building sun calendar: %s', err)
 
-        if not self.args.daemon:
-            print(lat, lon, tz_name, self.timezone, flush=True)
+        self.building_sun_calendar = False
+
+        # The location may have changed while we were building
+        if self.astral_info is not astral_info:
+            self.check_sun_calendar()
 
     def should_run(self, mode):
         ''' Should we run this mode?
@@ -1648,7 +1969,7 @@ class Main():
             self.state == State.WIFI_ACTIVE
             and self.is_on
             and self.display_mode == mode
-            and not (self.button_down_time or self.button_presses)
+            and not self.button.active
             and not self.futzing)
 
 
@@ -1660,41 +1981,6 @@ class Main():
             round((timestamp + offset*60) / (5*60)) * 5*60,
             tz=self.timezone)
 
-    def get_next_poem_index(self):
-        ''' Return the next random poem index
-        '''
-        index = self.poem_index
-        self.poem_index = (self.poem_index + 1) % len(ALL_POEMS)
-        return index
-
-    def print_debug(self, *argv, force=False):
-        ''' Print a message if in debug mode
-        '''
-        if self.args.debug or force:
-            print(*argv, flush=True)
-
-
-def check_wifi(debug):
-    ''' Check wifi status in background
-    '''
-    matcher = re.compile(r'\s*inet\s+(?P<ip>\d+\.\d+\.\d+\.\d+).*broadcast')
-    output = subprocess.check_output(['ifconfig', 'wlan0']).decode()
-
-    for line in output.splitlines():
-        match = matcher.match(line)
-
-        if match:
-            if debug:
-                print(line)
-
-            return match.group('ip')
-
-    if debug:
-        print('-- ifconfig output --')
-        print(output, flush=True)
-
-    return None
-
 
 def interpolate1(start, end, factor):
     ''' Interpolote two points
@@ -1713,35 +1999,6 @@ def interpolate_color(color_start, color_end, start, end, timestamp):
         interpolate1(color_start[2], color_end[2], factor))
 
 
-def start_hotspot(debug):
-    ''' Switch to hotspot mode
-    '''
-    if debug:
-        print('starting hotspot', flush=True)
-
-    try:
-        subprocess.check_call(['hotspot', 'start'])
-        result = True
-    except Exception as err: #pylint: disable=broad-except
-        print('Failed to start hotspot: {}'.format(err), flush=True)
-        result = False
-
-    return result
-
-
-def start_wifi(state):
-    ''' Start wifi
-    '''
-    try:
-        if state == State.HOTSPOT:
-            subprocess.check_call(['hotspot', 'stop'])
-
-        subprocess.check_call(['wpa_cli', '-i', 'wlan0', 'reconfigure'])
-
-    except Exception as err: #pylint: disable=broad-except
-        print('Exception starting wifi: {}'.format(err), flush=True)
-
-
 def main():
     ''' do it
     '''
@@ -0,0 +1,57 @@
+'''
+A spatial index of the words on the clock face
+'''
+
+from bisect import bisect_left
+
+_NO_X = -1
+_END_X = 1 << 16
+
+
+class WordIndex():
+    ''' The words in grid order (top to bottom, left to right), with range
+        queries by row and column.
+    '''
+
+    def __init__(self, words):
+        self.words = sorted(words, key=lambda x: (x.y, x.x))
+        self._keys = [(word.y, word.x) for word in self.words]
+
+    def _position(self, y, x): #pylint: disable=invalid-name
+        ''' Return the grid order position of the first word at or after (y, x)
+        '''
+        return bisect_left(self._keys, (y, x))
+
+    def in_rows(self, y_begin, y_end=None):
+        ''' Return the words starting in rows y_begin up to, but not including, y_end
+        '''
+        begin = self._position(y_begin, _NO_X)
+        end = len(self.words) if y_end is None else self._position(y_end, _NO_X)
+        return self.words[begin:end]
+
+    def in_row(self, y, x_begin=0, x_end=_END_X): #pylint: disable=invalid-name
+        ''' Return the words starting in row y, in columns x_begin up to,
+            but not including, x_end
+        '''
+        return self.words[self._position(y, x_begin):self._position(y, x_end)]
+
+    def after(self, word0):
+        ''' Return the words after word0 on the grid, in grid order.
+            This agrees with poems.is_after().
+        '''
+        if word0.vertical:
+            word0_end = word0.end_y
+
+            return [
+                word1
+                for y_i in range(word0.y, word0_end + 1)
+                for word1 in self.in_row(y_i, word0.x + 2)
+                ] + self.in_rows(word0_end + 1)
+
+        word0_end = word0.end_x
+
+        return (
+            self.in_row(word0.y, word0_end + 1) +
+            [word1 for word1 in self.in_row(word0.y + 1)
+             if not word1.vertical or word1.x < word0.x - 1 or word1.x > word0_end] +
+            self.in_rows(word0.y + 2))